@@ -0,0 +1,202 @@
+"""
+Benchmarks for the detector, run without a camera or a broker:
+
+    python benchmark.py segment --sizes 640x480 1920x1080 --colours 3 10
+    python benchmark.py hues
+    python benchmark.py region --size 1920x1080 --rois 1 0.5 0.25 --scales 1 0.5 0.25
+
+Frames are made from ``cornhole.jpg`` scaled to each size, or are random HSV pixels covering the
+whole of the hue circle.
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from region import Region
+from segment import HUES, ColourTable, create_colour_arrays, find_objects, inrange_masks
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def test_frame(width: int, height: int, image: str = 'cornhole.jpg') -> np.ndarray:
+    frame = cv2.imread(image)
+    if frame is None:
+        raise SystemExit(f'Cannot read {image}')
+    return cv2.resize(frame, (width, height))
+
+
+def test_colours(n: int, h_tol: int = 20, s_min: int = 100, v_min: int = 100) -> dict:
+    """
+    ``n`` colours spread around the hue circle from red, with limits as set by the detector
+    """
+    return {f'c{index}': create_colour_arrays({'h_cen': index * HUES // n, 'h_tol': h_tol,
+                                                's_min': s_min, 'v_min': v_min})
+            for index in range(n)}
+
+
+def per_frame(func, frames: int) -> float:
+    """
+    Mean seconds per call of ``func``
+    """
+    func()
+    start = time.perf_counter()
+    for _ in range(frames):
+        func()
+    return (time.perf_counter() - start) / frames
+
+
+def bench_segment(args):
+    """
+    Time segmenting a frame into the masks of every colour, with an inRange per colour and with
+    the lookup tables, and check both give the same masks
+    """
+    print(f'{"size":>10} {"colours":>8} {"inRange":>10} {"lut":>10} {"speedup":>8} {"rebuild":>10}')
+    for size in args.sizes:
+        width, height = parse_size(size)
+        hsv_image = cv2.cvtColor(test_frame(width, height), cv2.COLOR_BGR2HSV)
+        for n in args.colours:
+            colours = test_colours(n)
+            table = ColourTable(rows=args.rows)
+            # every update changes the thresholds
+            changed = test_colours(n, h_tol=19)
+            rebuild = per_frame(lambda: (table.update(changed), table.update(colours)), 100) / 2
+            expected = inrange_masks(hsv_image, colours)
+            found = table.masks(hsv_image)
+            if not all(np.array_equal(expected[name] > 0, found[name] > 0) for name in colours):
+                raise SystemExit(f'The lookup tables disagree with inRange at {size} with {n} colours')
+            inrange = per_frame(lambda: inrange_masks(hsv_image, colours), args.frames)
+            lut = per_frame(lambda: (table.update(colours), table.masks(hsv_image)), args.frames)
+            print(f'{size:>10} {n:>8} {inrange * 1000:>7.2f} ms {lut * 1000:>7.2f} ms {inrange / lut:>7.2f}x '
+                  f'{rebuild * 1e6:>7.0f} us')
+
+
+def random_hsv(width: int, height: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    hsv_image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    hsv_image[..., 0] = rng.integers(0, HUES, (height, width), dtype=np.uint8)
+    return hsv_image
+
+
+def bench_hues(args):
+    """
+    Check the masks of colours centred all round the hue circle, including those that wrap past 0
+    or 179, against the hue distance of every pixel, then time a colour that wraps and one that
+    does not
+    """
+    width, height = parse_size(args.size)
+    hsv_image = random_hsv(width, height)
+    hue = hsv_image[..., 0].astype(np.int16)
+    checked = 0
+    for h_tol in args.tolerances:
+        for h_cen in range(0, HUES, args.step):
+            colour = create_colour_arrays({'h_cen': h_cen, 'h_tol': h_tol, 's_min': 100, 'v_min': 100})
+            distance = (hue - h_cen) % HUES
+            expected = ((distance <= h_tol) | (distance >= HUES - h_tol)) & \
+                (hsv_image[..., 1] >= 100) & (hsv_image[..., 2] >= 100)
+            table = ColourTable()
+            table.update({'c': colour})
+            for name, mask in (('inRange', inrange_masks(hsv_image, {'c': colour})['c']),
+                               ('lut', table.masks(hsv_image)['c'])):
+                if not np.array_equal(mask > 0, expected):
+                    raise SystemExit(f'{name} mask is wrong for h_cen {h_cen}, h_tol {h_tol}: '
+                                     f'{np.count_nonzero(mask)} pixels found, {np.count_nonzero(expected)} expected')
+            checked += 1
+    print(f'{checked} colours checked at {args.size}, all masks correct')
+
+    print(f'{"colour":>16} {"inRange":>10} {"lut":>10}')
+    for label, h_cen in (('wraps (h_cen 0)', 0), ('h_cen 60', 60)):
+        colours = {'c': create_colour_arrays({'h_cen': h_cen, 'h_tol': 20, 's_min': 100, 'v_min': 100})}
+        table = ColourTable()
+        table.update(colours)
+        inrange = per_frame(lambda: inrange_masks(hsv_image, colours), args.frames)
+        lut = per_frame(lambda: table.masks(hsv_image), args.frames)
+        print(f'{label:>16} {inrange * 1000:>7.2f} ms {lut * 1000:>7.2f} ms')
+
+
+def centred_roi(width: int, height: int, fraction: float):
+    """
+    A region of ``fraction`` of the width and height in the middle of the frame, None for all of it
+    """
+    if fraction >= 1:
+        return None
+    w, h = round(width * fraction), round(height * fraction)
+    return [(width - w) // 2, (height - h) // 2, w, h]
+
+
+def detect(region: Region, frame: np.ndarray, colours: dict, table: ColourTable) -> list[tuple]:
+    """
+    The processing stage of the detector, objects found in the region in pixels of the frame
+    """
+    image, mapping = region.apply(frame)
+    factor = mapping[2] * mapping[3]
+    return [(col_name,) + region.to_frame(rect, area, mapping)
+            for col_name, _, area, rect in find_objects(image, colours, table, 0, 200 * factor, 800 * factor)]
+
+
+def bench_region(args):
+    """
+    Check squares of each colour are found at the right place in pixels of the full frame, then time
+    the processing of a frame for each size of region and scale
+    """
+    width, height = parse_size(args.size)
+    colours = test_colours(3)
+    squares = np.zeros((height, width, 3), np.uint8)
+    expected = []
+    for index, colour in enumerate(colours.values()):
+        x, y = width // 2 - 60 + index * 40, height // 2 - 12
+        cv2.rectangle(squares, (x, y), (x + 23, y + 23), colour['bgr'], -1)
+        expected.append((x, y))
+
+    print(f'{"roi":>12} {"scale":>6} {"frame":>10} {"fps":>7} {"error":>6}')
+    for fraction in args.rois:
+        for scale in args.scales:
+            region = Region(centred_roi(width, height, fraction), scale)
+            table = ColourTable()
+            found = sorted(rect[:2] for _, rect, _ in detect(region, squares, colours, table))
+            if len(found) != len(expected):
+                raise SystemExit(f'Found {len(found)} of {len(expected)} squares with roi {fraction}, scale {scale}')
+            error = max(max(abs(fx - x), abs(fy - y)) for (fx, fy), (x, y) in zip(found, expected))
+            frame = test_frame(width, height)
+            seconds = per_frame(lambda: detect(region, frame, colours, table), args.frames)
+            roi = region.current[1]
+            size = f'{roi[2]}x{roi[3]}' if roi else 'full'
+            print(f'{size:>12} {scale:>6} {seconds * 1000:>7.2f} ms {1 / seconds:>7.1f} {error:>4} px')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cornhole detector benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    segment = subparsers.add_parser('segment', help='colour masks with inRange per colour and with lookup tables')
+    segment.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080'])
+    segment.add_argument('--colours', type=int, nargs='+', default=[3, 10])
+    segment.add_argument('--frames', type=int, default=100)
+    segment.add_argument('--rows', type=int, default=64, help='rows segmented at a time with the lookup tables')
+    segment.set_defaults(func=bench_segment)
+
+    hues = subparsers.add_parser('hues', help='colour masks all round the hue circle, including wrap around')
+    hues.add_argument('--size', default='640x480')
+    hues.add_argument('--tolerances', type=int, nargs='+', default=[0, 5, 20, 89])
+    hues.add_argument('--step', type=int, default=1, help='hues between the colour centres checked')
+    hues.add_argument('--frames', type=int, default=100)
+    hues.set_defaults(func=bench_hues)
+
+    region = subparsers.add_parser('region', help='frame rate with the region of interest and scale')
+    region.add_argument('--size', default='1920x1080')
+    region.add_argument('--rois', type=float, nargs='+', default=[1, 0.75, 0.5, 0.25],
+                        help='width and height of the region, as a fraction of the frame')
+    region.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5, 0.25])
+    region.add_argument('--frames', type=int, default=50)
+    region.set_defaults(func=bench_region)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+The colour thresholds of the detector. They are changed from the trackbars of the Controls window
+or by a message on ``detector/calibrate``::
+
+    {"r": {"h_cen": 2, "h_tol": 15}, "b": {"s_min": 120}}
+
+Each change rebuilds the limits of the colours changed, in a new set of colours, and bumps the
+version, so the processing stage only has to compare versions each frame to know whether its
+thresholds are still current.
+"""
+import json
+import logging
+import threading
+
+from segment import create_colour_arrays
+
+#: the settings of a colour and their largest values
+SETTINGS = {'h_cen': 179, 'h_tol': 89, 's_min': 255, 'v_min': 255}
+
+
+class Calibration:
+    """
+    Versioned colour thresholds
+
+    Args:
+        colours: the ``colours`` section of the detector settings
+    """
+    topic = 'detector/calibrate'
+
+    def __init__(self, colours: dict):
+        self._lock = threading.Lock()
+        #: ``(version, colours)``, replaced as a whole so it can be read without the lock
+        self.current = (0, {col_name: create_colour_arrays({key: int(colour[key]) for key in SETTINGS})
+                            for col_name, colour in colours.items()})
+
+    @property
+    def version(self) -> int:
+        return self.current[0]
+
+    @property
+    def colours(self) -> dict:
+        return self.current[1]
+
+    def update(self, changes: dict) -> bool:
+        """
+        Change the settings of some colours, safe to call from any thread
+
+        :param changes: new settings keyed by colour, e.g. ``{"r": {"h_cen": 2}}``, values beyond
+            the range of a setting are clipped to it
+        :return: whether anything changed
+        """
+        with self._lock:
+            version, colours = self.current
+            updated = dict(colours)
+            for col_name, settings in changes.items():
+                if col_name not in colours:
+                    logging.warning('Calibration of unknown colour %s ignored', col_name)
+                    continue
+                values = {key: colours[col_name][key] for key in SETTINGS}
+                for key, value in settings.items():
+                    if key not in SETTINGS:
+                        logging.warning('Unknown calibration setting %s of colour %s ignored', key, col_name)
+                        continue
+                    values[key] = min(max(int(value), 0), SETTINGS[key])
+                if any(values[key] != colours[col_name][key] for key in SETTINGS):
+                    updated[col_name] = create_colour_arrays(values)
+            if all(updated[col_name] is colours[col_name] for col_name in colours):
+                return False
+            self.current = (version + 1, updated)
+        logging.info('Calibration %s: %s', version + 1, changes)
+        return True
+
+    def set(self, col_name: str, key: str, value: int) -> bool:
+        return self.update({col_name: {key: value}})
+
+    def on_message(self, client, userdata, msg):
+        """
+        Message callback for ``detector/calibrate``
+        """
+        try:
+            changes = json.loads(msg.payload)
+            if not isinstance(changes, dict) or not all(isinstance(settings, dict) for settings in changes.values()):
+                raise ValueError('should map colours to their settings')
+            self.update(changes)
+        except (ValueError, TypeError) as e:
+            logging.error('Calibration message %s ignored: %s', msg.payload, e)
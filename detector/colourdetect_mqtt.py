@@ -5,15 +5,19 @@ import yaml
 import time
 import logging.config
 import uuid
-import colorsys
 import cv2
-import numpy as np
 import sys
 import time
 from collections import deque
 from os.path import exists
 import json
 
+import queue_logging
+from pipeline import LatestFrame, Stage, StageStats
+from segment import ColourTable, find_objects
+from calibration import Calibration, SETTINGS
+from region import Region
+
 cv2.Tracker
 def readconfigfile(inputfile):
     logging.info("Reading config file: config.yaml")
@@ -50,7 +54,7 @@ def on_connect(client, userdata, flags, rc):
 def on_message(client, userdata, msg):
     global newgame
     msg.payload = str(msg.payload.decode("utf-8"))
-    logging.debug(msg.topic+" "+msg.payload) 
+    logging.debug('%s %s', msg.topic, msg.payload)
 
 if exists('detector/config.yaml'):
     conf_file = 'detector/config.yaml'
@@ -61,14 +65,17 @@ else:
     quit()
 mqttbroker, detectorsettings, logconf = readconfigfile(conf_file)
 
-#configure logging
-logconf = {
-    'version': 1,
-    'loggers': {
-        'root': logconf
+#configure logging, from a full dictConfig dictionary or just the settings of the root logger
+if 'version' not in logconf:
+    logconf = {
+        'version': 1,
+        'queue': logconf.pop('queue', False),
+        'limits': logconf.pop('limits', None),
+        'loggers': {
+            'root': logconf
+        }
     }
-}
-logging.config.dictConfig(logconf)
+queue_logging.configure(logconf)
 
 #Parse command line arguments (e.g. to determine if running in Docker stack)
 inDocker = False
@@ -91,7 +98,8 @@ if inDocker:
     logging.info("Starting connection, waiting for 5 seconds for broker to spawn")
     time.sleep(5)
 else:
-    logging.info("Starting connection: Ensure that your MQTT broker is running at " + str(mqttbroker['broker']) + ":" + str(mqttbroker['port']))
+    logging.info('Starting connection: Ensure that your MQTT broker is running at %s:%s',
+                 mqttbroker['broker'], mqttbroker['port'])
 print('Starting MQTT listener')
 print(client)
 
@@ -102,52 +110,23 @@ else:
     try:
         image_source = cv2.imread(detectorsettings['image_file'])
     except FileNotFoundError:
-        logging.error('File ' + detectorsettings['image_file'] + ' not found')
+        logging.error('File %s not found', detectorsettings['image_file'])
 
 #Read Colourmaps
 colour_map = detectorsettings['colours']
 logging.info(colour_map) 
+calibration = Calibration(colour_map)
+client.message_callback_add(Calibration.topic, calibration.on_message)
+#Only the region of the frame bags are held in is searched, scaled down by the scale factor
+region = Region(detectorsettings.get('roi'), detectorsettings.get('scale', 1))
+client.message_callback_add(Region.topic, region.on_message)
 
 
 def click_event(event, x, y, flags, param):
     global shutdown
     if event == cv2.EVENT_LBUTTONDOWN:
         clicked_colour = frame[y,x]
-        logging.debug('Clicked colour: '+ str(clicked_colour))
-
-def trackbar_callback(value):
-    pass    
-
-def create_colour_arrays(val):   
-    hUpper = val['h_cen'] + val['h_tol']
-    hLower = val['h_cen'] - val['h_tol']
-    splitmask = False
-    if hUpper > 179:
-        hUpper -= 179
-        splitmask = True
-    elif hLower < 0:
-        hLower += 179
-        splitmask = True
-    s_min = val['s_min']
-    v_min = val['v_min']
-    s_max = 255
-    v_max = 255
-    val['splitmask'] = splitmask
-    if splitmask:
-        val['limits'] = {
-            'lower': np.array([hLower, s_min, v_min]),
-            'upper': np.array([179, s_max, v_max]),
-            'lower1': np.array([0, s_min, v_min]),
-            'upper1': np.array([hUpper, s_max, v_max])   
-        }
-    else:
-        val['limits'] = {
-            'lower': np.array([hLower, s_min, v_min]),
-            'upper': np.array([hUpper, s_max, v_max])
-        }
-    val['bgr'] = colorsys.hsv_to_rgb(val['h_cen'] / 180, 1, 1)
-    val['bgr'] = tuple(int(x * 255) for x in reversed(val['bgr']))
-    return val
+        logging.debug('Clicked colour: %s', clicked_colour)
 
 def cal_colour(state, userdata):
     print(str(state) + state(userdata))
@@ -162,17 +141,17 @@ else:
     headless = True
 
 
-#Initial Detector Settings
-for col_name, colour in colour_map.items():
-    for key, val2 in colour.items():
-        if key == 'h_cen':
-            maxV = 179
-        elif key =='h_tol':
-            maxV = 89
-        else:
-            maxV = 255
-        cv2.createTrackbar(col_name + ' ' + key, 'Controls', val2, maxV, trackbar_callback)
-    colour = create_colour_arrays(colour)
+def trackbar_callback(col_name, key):
+    return lambda value: calibration.set(col_name, key, value)
+
+
+#Initial Detector Settings, the trackbars change the calibration as they are moved
+if not headless:
+    for col_name, colour in calibration.colours.items():
+        for key, maxV in SETTINGS.items():
+            cv2.createTrackbar(col_name + ' ' + key, 'Controls', colour[key], maxV,
+                               trackbar_callback(col_name, key))
+shown_version = calibration.version
 
 #tracker = cv2.legacy.TrackerKCF_create()
 #initBB = None
@@ -180,55 +159,90 @@ for col_name, colour in colour_map.items():
 
 client.loop_start()
 shutdown = False 
-cv2.setMouseCallback('DetectorUI', click_event) 
-
-while not shutdown:
-    foundobjects = {}
-    if cv2.waitKey(1) == 27:
-        break
-    ret, frame = image_source.read()
-    if not ret:
-        logging.error('Video device unavailable')
+if not headless:
+    cv2.setMouseCallback('DetectorUI', click_event) 
+
+
+def process_frame(item):
+    """
+    Processing stage: find the objects of each colour in the region of a captured frame
+    """
+    number, captured, frame = item
+    image, mapping = region.apply(frame)
+    if not image.size:
+        return number, captured, frame, []
+    version, colours = calibration.current
+    # the area limits are in pixels of the full frame
+    factor = mapping[2] * mapping[3]
+    found = find_objects(image, colours, colour_table, version, 200 * factor, 800 * factor)
+    objects = []
+    for col_name, pic, area, rect in found:
+        rect, area = region.to_frame(rect, area, mapping)
+        objects.append((col_name, pic, area, rect))
+    return number, captured, frame, objects
+
+
+#Segment all the colours at once with lookup tables, or with an inRange per colour
+if detectorsettings.get('segmentation', 'lut') == 'lut':
+    colour_table = ColourTable()
+else:
+    colour_table = None
+capture = LatestFrame(image_source).start()
+processing = Stage('process', process_frame, capture.get).start()
+latency = StageStats('latency')
+stats_interval = detectorsettings.get('stats_interval', 5)
+next_stats = time.perf_counter() + stats_interval
+
+while not shutdown and not capture.failed:
+    if not headless and cv2.waitKey(1) == 27:
         break
-    #Read Inputs
-    for col_name, colour in colour_map.items():
-        for key in ['h_cen', 'h_tol', 's_min', 'v_min']:
-            colour[key] = cv2.getTrackbarPos(col_name + ' ' + key, 'Controls')
-        colour = create_colour_arrays(colour)
-    hsv_image = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    for col_name, colour in colour_map.items():
-        colour['mask0'] = cv2.inRange(hsv_image, colour['limits']['lower'], colour['limits']['upper'])
-        if colour['splitmask']:
-            colour['mask1'] = cv2.inRange(hsv_image, colour['limits']['lower1'], colour['limits']['upper1'])
-            colour['mask'] = colour['mask1']
-        else:
-            colour['mask'] = colour['mask0']
-        colour['filtered'] = cv2.bitwise_and(frame, frame, mask=colour['mask'])
-        contours, hierarch = cv2.findContours(colour['mask'],
-                                              cv2.RETR_EXTERNAL,
-                                              cv2.CHAIN_APPROX_SIMPLE)[-2:]
-        for pic, contour in enumerate(contours):
-            area = cv2.contourArea(contour)
-            if(area > 200 and area < 800):
-                logging.debug(col_name + ' object spotted')
-                x, y, w, h = cv2.boundingRect(contour)
-                foundobjects[col_name + str(pic)] = {
-                        'colour'    :   col_name,
-                        'pos'       :   (x + (w//2), y + (h//2)),
-                        'size'      :   area,     
-                }
-                frame = cv2.rectangle(frame, (x, y),
-                                      (x + w, y + h),
-                                      (colour['bgr']), 2)
-                cv2.imshow('DetectedImage', frame)
-                client.publish("detector/object", json.dumps(foundobjects))
-                 
+    #Show calibrations sent over MQTT on the trackbars
+    if not headless and calibration.version != shown_version:
+        shown_version, colours = calibration.current
+        for col_name, colour in colours.items():
+            for key in SETTINGS:
+                cv2.setTrackbarPos(col_name + ' ' + key, 'Controls', colour[key])
+    result = processing.get(timeout=0.1)
+    if result is None:
+        continue
+    number, captured, frame, found = result
+    foundobjects = {}
+    for col_name, pic, area, (x, y, w, h) in found:
+        logging.debug('%s object spotted', col_name)
+        foundobjects[col_name + str(pic)] = {
+                'colour'    :   col_name,
+                'pos'       :   (x + (w//2), y + (h//2)),
+                'size'      :   area,     
+        }
+    if foundobjects:
+        client.publish("detector/object", json.dumps(foundobjects))
+    latency.observe(time.perf_counter() - captured)
+    if not headless:
+        for col_name, pic, area, (x, y, w, h) in found:
+            frame = cv2.rectangle(frame, (x, y),
+                                  (x + w, y + h),
+                                  (calibration.colours[col_name]['bgr']), 2)
+        roi = region.current[1]
+        if roi is not None:
+            x, y, w, h = roi
+            frame = cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 255, 255), 1)
+        cv2.putText(frame, f'{latency.fps:.1f} fps  {latency.mean_ms:.0f} ms', (10, 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        cv2.imshow('DetectedImage', frame)
         cv2.imshow('DetectorUI', frame)
+    if stats_interval and time.perf_counter() >= next_stats:
+        next_stats += stats_interval
+        stats = {stage.name: stage.as_dict() for stage in (capture.stats, processing.stats, latency)}
+        logging.info('Detector %.1f fps, %.1f ms from capture to publish: %s',
+                     latency.fps, latency.mean_ms, stats)
+        client.publish("detector/stats", json.dumps(stats))
 
 
 
 #Init Detector Thread
 
+processing.stop()
+capture.stop()
 image_source.release()
 cv2.destroyAllWindows()
 
@@ -0,0 +1,195 @@
+"""
+Staged pipeline for the detector. A capture thread reads the camera as fast as it delivers frames
+and keeps only the latest one, so a slow stage never leaves stale frames queued in the camera
+buffer. Each later stage runs on a thread of its own, fed by a bounded queue that drops its oldest
+item when full, so the frame being processed is never more than one frame behind the camera.
+
+Every stage keeps its own timing and frame rate, see :class:`StageStats`.
+"""
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class StageStats:
+    """
+    Timing of one stage of the pipeline
+
+    Args:
+        name: the stage, as reported
+        smoothing: weight of the newest observation in the running averages
+    """
+    def __init__(self, name: str, smoothing: float = 0.1):
+        self.name = name
+        self.smoothing = smoothing
+        self.count = 0
+        self.dropped = 0
+        self.mean_ms = 0.0
+        self.max_ms = 0.0
+        self.fps = 0.0
+        self._last = None
+
+    def observe(self, seconds: float):
+        """
+        Record the time a stage took over one item
+        """
+        ms = seconds * 1000
+        now = time.perf_counter()
+        if self.count:
+            self.mean_ms += self.smoothing * (ms - self.mean_ms)
+            interval = now - self._last
+            if interval > 0:
+                self.fps += self.smoothing * (1 / interval - self.fps)
+        else:
+            self.mean_ms = ms
+        self.max_ms = max(self.max_ms, ms)
+        self._last = now
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        return {'frames': self.count, 'dropped': self.dropped, 'fps': round(self.fps, 1),
+                'mean_ms': round(self.mean_ms, 2), 'max_ms': round(self.max_ms, 2)}
+
+
+class LatestFrame:
+    """
+    Reads frames from a ``cv2.VideoCapture`` on a thread of its own, keeping only the latest
+
+    A still image (an array from ``cv2.imread``) can be given instead of a capture, it is then
+    delivered as every frame, a new copy once the last one has been taken.
+
+    Args:
+        source: the capture, or the image
+    """
+    def __init__(self, source):
+        self.source = source
+        self.stats = StageStats('capture')
+        self.failed = False
+        self._frame = None
+        self._number = 0
+        self._lock = threading.Lock()
+        self._fresh = threading.Condition(self._lock)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='capture', daemon=True)
+
+    def _read(self):
+        if isinstance(self.source, np.ndarray):
+            with self._lock:
+                self._fresh.wait_for(lambda: self._frame is None or self._stopped)
+            return True, self.source.copy()
+        return self.source.read()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped:
+            start = time.perf_counter()
+            ret, frame = self._read()
+            if not ret:
+                logging.error('Video device unavailable')
+                with self._lock:
+                    self.failed = True
+                    self._fresh.notify_all()
+                return
+            captured = time.perf_counter()
+            self.stats.observe(captured - start)
+            with self._lock:
+                if self._frame is not None:
+                    # never picked up by the next stage
+                    self.stats.dropped += 1
+                self._frame = (self._number, captured, frame)
+                self._number += 1
+                self._fresh.notify_all()
+
+    def get(self, timeout: float = None):
+        """
+        Wait for a frame newer than the last one returned
+
+        :return: ``(number, captured, frame)``, ``captured`` from ``time.perf_counter``, or None
+            if the capture failed, was stopped or no frame arrived in time
+        """
+        with self._lock:
+            if not self._fresh.wait_for(lambda: self._frame is not None or self.failed or self._stopped,
+                                        timeout):
+                return None
+            item, self._frame = self._frame, None
+            self._fresh.notify_all()
+            return item
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._fresh.notify_all()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class Stage:
+    """
+    A stage of the pipeline, calls ``work`` on a thread of its own with each item taken from
+    ``source`` and puts the results on a bounded queue for the next stage
+
+    Args:
+        name: the stage
+        work: called with each item, returns the result passed on, or None to pass nothing on
+        source: called with a timeout in seconds to get the next item, None if there is none
+        maxsize: results held for the next stage, the oldest is dropped to make room
+    """
+    def __init__(self, name: str, work, source, maxsize: int = 1):
+        self.name = name
+        self.work = work
+        self.source = source
+        self.results = queue.Queue(maxsize)
+        self.stats = StageStats(name)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.is_set():
+            item = self.source(0.1)
+            if item is None:
+                continue
+            start = time.perf_counter()
+            try:
+                result = self.work(item)
+            except Exception:
+                logging.exception('Pipeline stage %s failed', self.name)
+                continue
+            self.stats.observe(time.perf_counter() - start)
+            if result is not None:
+                self.put(result)
+
+    def put(self, result):
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                    self.stats.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float = None):
+        """
+        The next result, or None if there is none within ``timeout`` seconds
+        """
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,120 @@
+"""
+The part of the frame searched for objects, and the scale it is searched at. Bags are only ever
+held in a known region in front of the player, so only that region of each frame is segmented,
+as a view of the frame rather than a copy, optionally scaled down first. Positions and sizes found
+are mapped back to pixels of the full frame.
+
+Set from ``roi`` and ``scale`` in the detector settings, or by a message on ``detector/region``::
+
+    {"roi": [480, 270, 960, 540], "scale": 0.5}
+
+``roi`` is ``[x, y, width, height]`` in pixels of the full frame, ``null`` for the whole frame.
+"""
+import json
+import logging
+import threading
+
+import cv2
+
+
+class Region:
+    """
+    Versioned region of interest and scale
+
+    Args:
+        roi: ``[x, y, width, height]``, None for the whole frame
+        scale: factor the region is scaled by before it is segmented, at most 1
+    """
+    topic = 'detector/region'
+
+    def __init__(self, roi=None, scale: float = 1):
+        self._lock = threading.Lock()
+        #: ``(version, roi, scale)``, replaced as a whole so it can be read without the lock
+        self.current = (0, self._check_roi(roi), self._check_scale(scale))
+
+    @staticmethod
+    def _check_roi(roi):
+        if roi is None:
+            return None
+        x, y, width, height = (int(value) for value in roi)
+        if x < 0 or y < 0 or width < 1 or height < 1:
+            raise ValueError(f'roi {roi} should be [x, y, width, height] inside the frame')
+        return x, y, width, height
+
+    @staticmethod
+    def _check_scale(scale):
+        scale = float(scale)
+        if not 0 < scale <= 1:
+            raise ValueError(f'scale {scale} should be more than 0 and at most 1')
+        return scale
+
+    @property
+    def version(self) -> int:
+        return self.current[0]
+
+    def update(self, changes: dict) -> bool:
+        """
+        Change the ``roi`` and/or ``scale``, safe to call from any thread
+
+        :return: whether anything changed
+        :raises ValueError: if a value is out of range, nothing is changed
+        """
+        with self._lock:
+            version, roi, scale = self.current
+            if 'roi' in changes:
+                roi = self._check_roi(changes['roi'])
+            if 'scale' in changes:
+                scale = self._check_scale(changes['scale'])
+            if (roi, scale) == self.current[1:]:
+                return False
+            self.current = (version + 1, roi, scale)
+        logging.info('Detection region %s: roi %s, scale %s', version + 1, roi, scale)
+        return True
+
+    def on_message(self, client, userdata, msg):
+        """
+        Message callback for ``detector/region``
+        """
+        try:
+            changes = json.loads(msg.payload)
+            if not isinstance(changes, dict):
+                raise ValueError('should be a mapping with roi and/or scale')
+            self.update(changes)
+        except (ValueError, TypeError) as e:
+            logging.error('Detection region message %s ignored: %s', msg.payload, e)
+
+    def apply(self, frame):
+        """
+        The part of the frame to segment
+
+        :return: ``(image, (x, y, fx, fy))``, the image and the offset and scale factors that map
+            its pixels back to the frame, ``frame_x = x + image_x / fx``
+        """
+        _, roi, scale = self.current
+        if roi is None:
+            x, y = 0, 0
+            image = frame
+        else:
+            x, y, width, height = roi
+            # a view, clipped to the frame
+            image = frame[y:y + height, x:x + width]
+        if scale == 1 or not image.size:
+            return image, (x, y, 1, 1)
+        height, width = image.shape[:2]
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+        # OpenCV's area resize is only fast for halving, so halve while that is still too big
+        while image.shape[1] >= size[0] * 2 and image.shape[0] >= size[1] * 2:
+            image = cv2.resize(image, (image.shape[1] // 2, image.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        if image.shape[1::-1] != size:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image, (x, y, size[0] / width, size[1] / height)
+
+    @staticmethod
+    def to_frame(rect, area, mapping):
+        """
+        A bounding rectangle and area found in the image from :meth:`apply`, in pixels of the frame
+        """
+        x0, y0, fx, fy = mapping
+        x, y, w, h = rect
+        return ((x0 + round(x / fx), y0 + round(y / fy), round(w / fx), round(h / fy)),
+                area / (fx * fy))
@@ -0,0 +1,193 @@
+"""
+Colour segmentation for the detector, the masks of the pixels of each colour in an HSV frame.
+
+The thresholds of each colour are a box in HSV, a range of hues with a minimum saturation and
+value, so the test of a pixel splits into one test per channel. :class:`ColourTable` keeps, for
+each channel, a 256 entry table with one bit per colour set where the channel value is in that
+colour's range. A frame is segmented with a lookup per channel and two ANDs, giving an image of
+colour bits for up to eight colours at once, rather than a ``cv2.inRange`` over the whole frame
+for every colour. The tables are only rebuilt when the thresholds change.
+
+OpenCV hues run from 0 to 179. A colour whose hues wrap past either end, such as red, has two
+ranges of hue that differ only in hue, both are set in its hue table so it is still found in the
+one pass.
+"""
+import colorsys
+
+import cv2
+import numpy as np
+
+#: colours sharing one image of colour bits
+BANK_COLOURS = 8
+
+#: number of OpenCV hues, 0 to 179
+HUES = 180
+
+
+def create_colour_arrays(val):
+    """
+    Set the HSV ``limits`` of a colour from its ``h_cen``, ``h_tol``, ``s_min`` and ``v_min``, with
+    a second range, ``lower1`` to ``upper1``, when the hues wrap past 0 or 179, the ``boxes``, a
+    list of the ``(lower, upper)`` ranges, and the ``bgr`` colour its objects are outlined in
+    """
+    hUpper = val['h_cen'] + val['h_tol']
+    hLower = val['h_cen'] - val['h_tol']
+    splitmask = False
+    if val['h_tol'] * 2 + 1 >= HUES:
+        hLower, hUpper = 0, HUES - 1
+    elif hUpper >= HUES:
+        hUpper -= HUES
+        splitmask = True
+    elif hLower < 0:
+        hLower += HUES
+        splitmask = True
+    s_min = val['s_min']
+    v_min = val['v_min']
+    s_max = 255
+    v_max = 255
+    val['splitmask'] = splitmask
+    if splitmask:
+        val['limits'] = {
+            'lower': np.array([hLower, s_min, v_min]),
+            'upper': np.array([HUES - 1, s_max, v_max]),
+            'lower1': np.array([0, s_min, v_min]),
+            'upper1': np.array([hUpper, s_max, v_max])
+        }
+    else:
+        val['limits'] = {
+            'lower': np.array([hLower, s_min, v_min]),
+            'upper': np.array([hUpper, s_max, v_max])
+        }
+    val['boxes'] = [(val['limits']['lower'], val['limits']['upper'])]
+    if splitmask:
+        val['boxes'].append((val['limits']['lower1'], val['limits']['upper1']))
+    val['bgr'] = colorsys.hsv_to_rgb(val['h_cen'] / HUES, 1, 1)
+    val['bgr'] = tuple(int(x * 255) for x in reversed(val['bgr']))
+    return val
+
+
+def inrange_masks(hsv_image: np.ndarray, colours: dict) -> dict:
+    """
+    The mask of each colour, with a ``cv2.inRange`` over the frame per range of each colour, so
+    two passes and an OR for a colour whose hues wrap
+    """
+    masks = {}
+    for col_name, colour in colours.items():
+        mask = None
+        for lower, upper in colour['boxes']:
+            found = cv2.inRange(hsv_image, lower, upper)
+            mask = found if mask is None else cv2.bitwise_or(mask, found, mask)
+        masks[col_name] = mask
+    return masks
+
+
+class ColourTable:
+    """
+    Per channel lookup tables from HSV to colour bits
+
+    Args:
+        rows: rows of the frame segmented at a time, so the intermediate images stay in cache
+    """
+    def __init__(self, rows: int = 64):
+        self.rows = rows
+        self.builds = 0
+        self.names = []
+        self.version = None
+        self._thresholds = None
+        self._tables = []
+        self._shape = None
+
+    def update(self, colours: dict, version: int = None) -> bool:
+        """
+        Rebuild the tables if the thresholds of the colours have changed
+
+        :param version: of the colours, if given the thresholds are only compared when it changes
+        :return: whether the tables were rebuilt
+        """
+        if version is not None and version == self.version:
+            return False
+        self.version = version
+        thresholds = tuple((col_name, tuple((tuple(lower), tuple(upper)) for lower, upper in colour['boxes']))
+                           for col_name, colour in colours.items())
+        if thresholds == self._thresholds:
+            return False
+        self._thresholds = thresholds
+        self.names = [col_name for col_name, _ in thresholds]
+        self._tables = []
+        for bank in range(0, len(thresholds), BANK_COLOURS):
+            tables = np.zeros((3, 256), np.uint8)
+            for bit, (_, boxes) in enumerate(thresholds[bank:bank + BANK_COLOURS]):
+                for lower, upper in boxes:
+                    for channel in range(3):
+                        tables[channel, lower[channel]:upper[channel] + 1] |= 1 << bit
+            self._tables.append(tables)
+        self._shape = None
+        self.builds += 1
+        return True
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self._bits = [np.empty((height, width), np.uint8) for _ in self._tables]
+        self._planes = [np.empty((self.rows, width), np.uint8) for _ in range(3)]
+        self._lookup = np.empty((self.rows, width), np.uint8)
+        self._masks = {col_name: np.empty((height, width), np.uint8) for col_name in self.names}
+        self._shape = shape
+
+    def segment(self, hsv_image: np.ndarray) -> list[np.ndarray]:
+        """
+        The colour bits of every pixel, one image for each bank of :data:`BANK_COLOURS` colours
+        """
+        if hsv_image.shape != self._shape:
+            self._allocate(hsv_image.shape)
+        for row in range(0, hsv_image.shape[0], self.rows):
+            band = hsv_image[row:row + self.rows]
+            rows = band.shape[0]
+            planes = [plane[:rows] for plane in self._planes]
+            cv2.split(band, planes)
+            lookup = self._lookup[:rows]
+            for tables, bits in zip(self._tables, self._bits):
+                bits = bits[row:row + rows]
+                cv2.LUT(planes[0], tables[0], bits)
+                cv2.LUT(planes[1], tables[1], lookup)
+                cv2.bitwise_and(bits, lookup, bits)
+                cv2.LUT(planes[2], tables[2], lookup)
+                cv2.bitwise_and(bits, lookup, bits)
+        return self._bits
+
+    def masks(self, hsv_image: np.ndarray) -> dict:
+        """
+        The mask of each colour, non zero where the colour was found
+
+        The masks are overwritten by the next call.
+        """
+        bits = self.segment(hsv_image)
+        for index, col_name in enumerate(self.names):
+            cv2.bitwise_and(bits[index // BANK_COLOURS], 1 << index % BANK_COLOURS, self._masks[col_name])
+        return self._masks
+
+
+def find_objects(image: np.ndarray, colours: dict, table: ColourTable = None, version: int = None,
+                 min_area: float = 200, max_area: float = 800) -> list[tuple]:
+    """
+    The objects of each colour in a BGR image, segmented with the lookup tables, or with an
+    inRange per colour if there is no ``table``
+
+    :return: ``(colour name, contour number, area, (x, y, width, height))`` of each contour with an
+        area between ``min_area`` and ``max_area``
+    """
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    if table is None:
+        masks = inrange_masks(hsv_image, colours)
+    else:
+        table.update(colours, version)
+        masks = table.masks(hsv_image)
+    found = []
+    for col_name, mask in masks.items():
+        contours, hierarch = cv2.findContours(mask,
+                                              cv2.RETR_EXTERNAL,
+                                              cv2.CHAIN_APPROX_SIMPLE)[-2:]
+        for pic, contour in enumerate(contours):
+            area = cv2.contourArea(contour)
+            if min_area < area < max_area:
+                found.append((col_name, pic, area, cv2.boundingRect(contour)))
+    return found
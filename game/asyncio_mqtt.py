@@ -0,0 +1,86 @@
+"""
+Drives a paho MQTT client from an asyncio event loop rather than paho's own network thread.
+
+The client socket is registered with the loop using ``add_reader``/``add_writer`` so every
+message callback runs on the event loop thread, in the order the messages arrived, alongside the
+game.
+"""
+import asyncio
+import logging
+import socket
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioHelper:
+    """
+    Attach a paho client to an asyncio event loop
+
+    Args:
+        loop: the running event loop
+        client: mqtt client instance, the connection should be configured with ``connect_async``
+        reconnect_delay: seconds to wait after the first failed attempt to (re)connect to the
+            broker, doubled after each failure up to ``max_reconnect_delay``
+        max_reconnect_delay: longest wait between attempts to connect
+    """
+    #: seconds between calls to the client's ``loop_misc``, for keepalives
+    misc_interval = 1
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client, reconnect_delay: float = 0.05,
+                 max_reconnect_delay: float = 0.5):
+        self.loop = loop
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.misc = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        logging.debug('MQTT socket opened')
+        self.loop.add_reader(sock, client.loop_read)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048)
+
+    def on_socket_close(self, client, userdata, sock):
+        logging.debug('MQTT socket closed')
+        self.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def start(self):
+        """
+        Start the task that connects to the broker and handles keepalives and reconnection
+        """
+        self.misc = self.loop.create_task(self.misc_loop())
+        return self.misc
+
+    def stop(self):
+        if self.misc is not None:
+            self.misc.cancel()
+        self.client.disconnect()
+
+    async def misc_loop(self):
+        connected = False
+        delay = self.reconnect_delay
+        while True:
+            if not connected:
+                try:
+                    self.client.reconnect()
+                    connected = True
+                    delay = self.reconnect_delay
+                except OSError as e:
+                    logging.warning('Cannot connect to broker, retrying in %.2f s: %s', delay, e)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+            elif self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                logging.warning('Lost connection to broker')
+                connected = False
+                continue
+            await asyncio.sleep(self.misc_interval)
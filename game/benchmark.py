@@ -0,0 +1,856 @@
+"""
+Benchmarks for the game loop, run without a broker:
+
+    python benchmark.py interrupt --gametime 5 --hits 50
+
+These run in real time, with the MQTT client replaced by the simulator's recorder, so that the
+game can be driven from a thread in the same way that the paho network thread drives it in
+``main.py``. See ``simulator.py`` for game throughput in virtual time.
+
+    python benchmark.py transport --transport asyncio
+
+checks a real paho client over a transport against the in-process broker in ``minibroker.py``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import tracemalloc
+
+import paho.mqtt.client as mqtt
+import yaml
+
+from asyncio_mqtt import AsyncioHelper
+from make_game import MakeGame
+from boards import Boards
+import queue_logging
+from config_reload import ConfigWatcher
+from leaderboard import LeaderboardService, LeaderboardStore
+from journal import Journal, encode, HOLE
+from minibroker import MiniBroker
+from simulator import FakeClient, Simulation, switch_message
+
+
+def bench_settings(gametime, nholes=5, status_window=0.05):
+    return {
+        'status_window': status_window,
+        'colours': ['red', 'blue', 'cyan'],
+        'nHoles': nholes,
+        'hole_scores': [10] * nholes,
+        'difficulty': 1,
+        'gametime': gametime,
+        'bonusMult': 3,
+        'holeconfig': {'prob_on': 0.7, 'max_on_time': 0.5, 'min_on_time': 0.2,
+                       'max_off_time': 1, 'min_off_time': 0.5},
+    }
+
+
+def bench_interrupt(args):
+    """
+    Run one simulated game, firing switch hits from a separate thread, and report the CPU time used
+    by the process and the delay from each hit to the score being published
+    """
+    client = FakeClient()
+    game = MakeGame(bench_settings(args.gametime, args.holes, args.status_window), client)
+    latencies = []
+    pending = {}
+
+    def on_publish(topic, payload):
+        if topic == 'game/status' and 'hit' in pending:
+            latencies.append(time.perf_counter() - pending.pop('hit'))
+    client.on_publish = on_publish
+
+    def thrower():
+        rng = random.Random(args.seed)
+        time.sleep(0.2)
+        for _ in range(args.hits):
+            time.sleep(rng.uniform(0.5, 1.5) * (args.gametime - 0.5) / args.hits)
+            colour = rng.choice(['red', 'off'])
+            if colour != 'off':
+                # only hits on a lit hole change the score, and so the status
+                pending['hit'] = time.perf_counter()
+            game.switchevent(switch_message(rng.randint(1, args.holes), colour))
+
+    game.command = 'run'
+    thread = threading.Thread(target=thrower, daemon=True)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    thread.start()
+    asyncio.run(game.startgame())
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    thread.join()
+
+    print(f'game time        {wall:.2f} s wall, {cpu:.3f} s CPU ({100 * cpu / wall:.1f} %)')
+    print(f'messages         {len(client.published)}')
+    print(f'game/status      {game.status_publisher.published} published, '
+          f'{game.status_publisher.suppressed} suppressed')
+    print(f'holes/N          {sum(topic.startswith("holes/") for topic, _ in client.published)} published')
+    if latencies:
+        latencies_ms = sorted(x * 1000 for x in latencies)
+        print(f'hit to score     n={len(latencies_ms)} '
+              f'median={statistics.median(latencies_ms):.3f} ms '
+              f'max={latencies_ms[-1]:.3f} ms')
+
+
+def bench_standby(args):
+    """
+    Start a series of short games by sending the newgame command from a separate thread, as the
+    ``game/control`` callback does, and report the command to ``status: starting`` latency
+    """
+    client = FakeClient()
+    game = MakeGame(bench_settings(args.gametime), client)
+    done = threading.Event()
+
+    def controller():
+        time.sleep(0.1)
+        for _ in range(args.games):
+            game.command = 'run'
+            time.sleep(args.gametime + 0.1)
+        done.set()
+
+    async def run():
+        main_task = asyncio.create_task(game.main())
+        await asyncio.get_running_loop().run_in_executor(None, done.wait)
+        main_task.cancel()
+
+    threading.Thread(target=controller, daemon=True).start()
+    asyncio.run(run())
+    print(json.dumps(game.stats(), indent=2))
+
+
+def bench_reset(args):
+    """
+    Time back to back resets of a game and measure the memory held by a game and allocated by
+    each reset
+    """
+    client = FakeClient()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    game = MakeGame(bench_settings(120, args.holes), client)
+    size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    for hole in game.holes:
+        hole.status = True
+    start = time.perf_counter()
+    for _ in range(args.resets):
+        game.reset()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    game.reset()
+    reset_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f'game memory      {size / 1024:.1f} KiB with {args.holes} holes')
+    print(f'reset            {elapsed / args.resets * 1e6:.1f} us per reset')
+    print(f'reset peak alloc {reset_peak} bytes')
+
+
+def bench_boards(args):
+    """
+    Play a game on many boards at once in one event loop, firing switch hits at random boards from
+    a separate thread, and report the CPU time used and the hit to score latency
+    """
+    client = FakeClient()
+    boards = Boards(bench_settings(args.gametime), client, range(1, args.boards + 1))
+    latencies = []
+    pending = {}
+
+    def on_publish(topic, payload):
+        if topic.endswith('/game/status'):
+            hit = pending.pop(topic[:-len('game/status')], None)
+            if hit is not None:
+                latencies.append(time.perf_counter() - hit)
+    client.on_publish = on_publish
+
+    stop = threading.Event()
+
+    def thrower():
+        rng = random.Random(args.seed)
+        deadline = time.perf_counter() + args.gametime
+        stop.wait(0.2)
+        for _ in range(args.hits):
+            # hits stop with the games, the random gaps can add up to more than the game time
+            if stop.wait(rng.uniform(0.5, 1.5) * (args.gametime - 0.5) / args.hits) or \
+                    time.perf_counter() >= deadline:
+                return
+            msg = switch_message(rng.randint(1, 5))
+            msg.topic = f'board/{rng.randint(1, args.boards)}/{msg.topic}'
+            game, msg = boards.route(msg)
+            pending[game.prefix] = time.perf_counter()
+            game.switchevent(msg)
+
+    async def run():
+        await asyncio.gather(*(game.startgame() for game in boards))
+        # before the loop closes, a late hit would wake a closed loop
+        stop.set()
+        thread.join()
+
+    thread = threading.Thread(target=thrower, daemon=True)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    thread.start()
+    asyncio.run(run())
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    print(f'boards           {len(boards)}')
+    print(f'game time        {wall:.2f} s wall, {cpu:.3f} s CPU ({100 * cpu / wall:.1f} %)')
+    print(f'messages         {len(client.published)}')
+    if latencies:
+        latencies_ms = sorted(x * 1000 for x in latencies)
+        print(f'hit to score     n={len(latencies_ms)} '
+              f'median={statistics.median(latencies_ms):.3f} ms '
+              f'p99={latencies_ms[int(len(latencies_ms) * 0.99)]:.3f} ms '
+              f'max={latencies_ms[-1]:.3f} ms')
+
+
+def bench_switches(args):
+    """
+    Fire hits on every hole as fast as possible from several threads during a game and check that
+    every one of them is scored
+    """
+    client = FakeClient()
+    settings = bench_settings(args.gametime)
+    game = MakeGame(settings, client)
+    expected = [0] * args.threads
+    fired = [0] * args.threads
+
+    def thrower(n):
+        rng = random.Random(n)
+        deadline = time.perf_counter() + args.gametime - 1
+        time.sleep(0.2)
+        while time.perf_counter() < deadline:
+            for _ in range(args.burst):
+                hole_id = rng.randint(1, settings['nHoles'])
+                game.switchevent(switch_message(hole_id))
+                expected[n] += settings['hole_scores'][hole_id - 1] * settings['bonusMult']
+                fired[n] += 1
+            time.sleep(args.burst / args.rate)
+
+    scores = []
+    client.on_publish = lambda topic, payload: (
+        scores.append(json.loads(payload)['score']) if topic == 'game/leaderboard' else None)
+    threads = [threading.Thread(target=thrower, args=(n,), daemon=True) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    asyncio.run(game.startgame())
+    for thread in threads:
+        thread.join()
+
+    stats = game.stats()['switch_events']
+    print(f'hits fired       {sum(fired)} ({sum(fired) / (args.gametime - 1.2):.0f} per second)')
+    print(f'switch events    {stats}')
+    print(f'score            {scores[-1]}, expected {sum(expected)}')
+    if stats['dropped'] or stats['scored'] != sum(fired) or scores[-1] != sum(expected):
+        print('Hits were lost')
+        raise SystemExit(1)
+
+
+def bench_holes(args):
+    """
+    Play games in virtual time on boards with more and more holes, to show how the cost of driving
+    the holes scales
+    """
+    print(f'{"holes":>6} {"ms/game":>9} {"us/hole/s":>10}')
+    for nholes in args.holes:
+        simulation = Simulation(bench_settings(args.gametime, nholes), seed=args.seed,
+                                throw_interval=args.gametime / (2 * nholes))
+        result = simulation.run(args.games)
+        per_game = result['seconds'] / args.games
+        print(f'{nholes:>6} {per_game * 1000:>9.2f} '
+              f'{per_game / (nholes * args.gametime) * 1e6:>10.2f}')
+
+
+class _SlowFileHandler(logging.FileHandler):
+    """
+    File handler that takes a fixed extra time per record, standing in for a slow SD card
+    """
+    def __init__(self, filename, delay_ms=0):
+        super().__init__(filename)
+        self.delay = delay_ms / 1000
+
+    def emit(self, record):
+        super().emit(record)
+        if self.delay:
+            time.sleep(self.delay)
+
+
+def bench_logging(args):
+    """
+    Play a game with a flood of switch hits and DEBUG logging of every hit on the event loop, with
+    logging off, written synchronously and written through the queue, and report how late the
+    event loop runs
+    """
+    logfile = os.path.join(tempfile.mkdtemp(), 'cornhole.log')
+    modes = {
+        'off': {'level': 'WARNING', 'queue': False},
+        'sync': {'level': 'DEBUG', 'queue': False},
+        'queue': {'level': 'DEBUG', 'queue': True},
+    }
+    print(f'{"logging":>8} {"lag p50":>9} {"lag p99":>9} {"lag max":>9} {"records":>8}')
+    for name, mode in modes.items():
+        listener = queue_logging.configure({
+            'version': 1,
+            'queue': mode['queue'],
+            'handlers': {'file': {'()': _SlowFileHandler, 'filename': logfile, 'delay_ms': args.disk_delay}},
+            'loggers': {'root': {'level': mode['level'], 'handlers': ['file']}},
+        })
+        client = FakeClient()
+        game = MakeGame(bench_settings(args.gametime), client)
+        lags = []
+        records = 0
+
+        async def sample():
+            loop = asyncio.get_running_loop()
+            while True:
+                due = loop.time() + 0.001
+                await asyncio.sleep(0.001)
+                lags.append(loop.time() - due)
+
+        def on_hit(msg):
+            nonlocal records
+            # as on_switch_message does for every message when MQTT runs on the event loop
+            logging.debug('%s %s', msg.topic, msg.payload)
+            records += 1
+            game.switchevent(msg)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            sampler = asyncio.create_task(sample())
+
+            def thrower():
+                rng = random.Random(0)
+                time.sleep(0.2)
+                deadline = time.perf_counter() + args.gametime - 0.5
+                while time.perf_counter() < deadline:
+                    loop.call_soon_threadsafe(on_hit, switch_message(rng.randint(1, 5)))
+                    time.sleep(1 / args.rate)
+            thread = threading.Thread(target=thrower, daemon=True)
+            thread.start()
+            await game.startgame()
+            sampler.cancel()
+            thread.join()
+
+        asyncio.run(run())
+        if listener is not None:
+            listener.stop()
+        for handler in logging.getLogger().handlers:
+            handler.close()
+        lags_ms = sorted(x * 1000 for x in lags)
+        print(f'{name:>8} {statistics.median(lags_ms):>6.3f} ms {lags_ms[int(len(lags_ms) * 0.99)]:>6.3f} ms '
+              f'{lags_ms[-1]:>6.3f} ms {records:>8}')
+
+
+def bench_reload(args):
+    """
+    Rewrite the configuration file with new hole scores and timings during a game flooded with
+    switch hits, and report how long each change takes to reach the game and that no hit is lost
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'config.yaml')
+    settings = bench_settings(args.gametime)
+    settings['switch_queue_size'] = 1 << 20
+
+    def write_config(n):
+        settings['hole_scores'] = [10 + n] * settings['nHoles']
+        settings['holeconfig'] = dict(settings['holeconfig'], max_on_time=0.5 + n / 100)
+        with open(path, 'w') as configfile:
+            yaml.safe_dump({'gamesettings': settings, 'switchsettings': {'interval': 50, 'hold_off': 3000}},
+                           configfile)
+
+    write_config(0)
+    client = FakeClient()
+    game = MakeGame(dict(settings), client)
+    watcher = ConfigWatcher(path, [game], client, interval=args.interval)
+    written = {}
+    latencies = []
+    fired = 0
+    reload = watcher.reload
+
+    def timed_reload():
+        changed = reload()
+        if 'hole_scores' in changed:
+            latencies.append(time.perf_counter() - written.pop(game.basic_points[0] - 10))
+        return changed
+    watcher.reload = timed_reload
+
+    def writer():
+        time.sleep(0.3)
+        for n in range(1, args.reloads + 1):
+            # a new mtime is needed for the change to be seen
+            time.sleep(max((args.gametime - 1) / args.reloads, 0.01))
+            written[n] = time.perf_counter()
+            write_config(n)
+
+    def thrower(loop):
+        nonlocal fired
+        rng = random.Random(0)
+        deadline = time.perf_counter() + args.gametime - 0.5
+        time.sleep(0.2)
+        while time.perf_counter() < deadline:
+            loop.call_soon_threadsafe(game.switchevent, switch_message(rng.randint(1, settings['nHoles'])))
+            fired += 1
+            time.sleep(1 / args.rate)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        watch_task = asyncio.create_task(watcher.run())
+        threads = [threading.Thread(target=writer, daemon=True),
+                   threading.Thread(target=thrower, args=(loop,), daemon=True)]
+        for thread in threads:
+            thread.start()
+        await game.startgame()
+        for thread in threads:
+            thread.join()
+        watch_task.cancel()
+
+    asyncio.run(run())
+    stats = game.stats()['switch_events']
+    apply_ms = watcher.reload_latency
+    latencies_ms = sorted(x * 1000 for x in latencies) or [0]
+    print(f'reloads          {watcher.reloads} of {args.reloads} changes, {watcher.failures} failed')
+    print(f'apply            mean={apply_ms.total / max(apply_ms.count, 1):.3f} ms per reload')
+    print(f'write to applied median={statistics.median(latencies_ms):.1f} ms max={latencies_ms[-1]:.1f} ms '
+          f'(polling every {args.interval * 1000:.0f} ms)')
+    print(f'switch events    {stats}, {fired} fired')
+    if stats['dropped'] or stats['scored'] != fired or game.holes[0].holeconfig != settings['holeconfig']:
+        print('Hits were lost or the last change was not applied')
+        raise SystemExit(1)
+
+
+def bench_leaderboard(args):
+    """
+    Grow a leaderboard database to hundreds of thousands of games and time adding a result, each
+    in a transaction of its own as at the end of a game, and the queries, at each size
+    """
+    store = LeaderboardStore(os.path.join(tempfile.mkdtemp(), 'leaderboard.db'))
+    rng = random.Random(0)
+    start = time.time() - 5 * 86400
+    print(f'{"games":>8} {"add":>9} {"top 10":>9} {"today":>9} {"player":>9}')
+    for size in args.sizes:
+        rows = []
+        for n in range(len(store), size):
+            when = start + n * 5 * 86400 / max(args.sizes)
+            rows.append((None, f'player{rng.randrange(size // 3 + 1)}', int(rng.gauss(600, 200)), 0, when,
+                         time.strftime('%Y-%m-%d', time.localtime(when))))
+        store.db.executemany('INSERT INTO games (board, user, score, twitter_follower, time, day) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        store.commit()
+
+        timings = {}
+        begin = time.perf_counter()
+        for _ in range(args.adds):
+            store.add(f'player{rng.randrange(size // 3 + 1)}', int(rng.gauss(600, 200)))
+            store.commit()
+        timings['add'] = (time.perf_counter() - begin) / args.adds
+        for name, query in (('top', lambda: store.top(10)), ('today', lambda: store.today(10)),
+                            ('player', lambda: store.player(f'player{rng.randrange(size // 3 + 1)}'))):
+            begin = time.perf_counter()
+            for _ in range(args.queries):
+                query()
+            timings[name] = (time.perf_counter() - begin) / args.queries
+        print(f'{len(store):>8} ' + ' '.join(f'{timings[name] * 1e6:>6.0f} us'
+                                              for name in ('add', 'top', 'today', 'player')))
+
+
+def bench_journal(args):
+    """
+    Append hole change records to a journal as fast as possible and report the cost of each append
+    to the caller and the rate at which the records reach the disk, for several fsync intervals.
+    Point ``--dir`` at the SD card to measure it.
+    """
+    print(f'{"fsync every":>12} {"append":>9} {"records/s":>10} {"MB/s":>7} {"fsyncs":>7}')
+    directory = tempfile.mkdtemp(dir=args.dir)
+    path = os.path.join(directory, 'unbuffered')
+    begin = time.perf_counter()
+    with open(path, 'ab') as unbuffered:
+        for n in range(args.unbuffered):
+            unbuffered.write(encode(n, HOLE, n % 5 + 1, True, 'red'))
+            unbuffered.flush()
+            os.fsync(unbuffered.fileno())
+    elapsed = time.perf_counter() - begin
+    print(f'{"record":>12} {elapsed / args.unbuffered * 1e6:>6.1f} us {args.unbuffered / elapsed:>10.0f} '
+          f'{os.path.getsize(path) / elapsed / 1e6:>7.2f} {args.unbuffered:>7}')
+
+    for interval in args.fsync_intervals:
+        journal = Journal(os.path.join(directory, f'journal-{interval}'), fsync_interval=interval)
+        begin = time.perf_counter()
+        for n in range(args.records):
+            journal.hole(n, n % 5 + 1, True, 'red')
+        appended = time.perf_counter() - begin
+        journal.close()
+        elapsed = time.perf_counter() - begin
+        print(f'{interval:>10} s {appended / args.records * 1e6:>6.1f} us {args.records / elapsed:>10.0f} '
+              f'{journal.bytes_written / elapsed / 1e6:>7.2f} {journal.syncs:>7}')
+
+
+def _wait_for_ready(process, timeout):
+    """
+    Wait for main.py to print that it is ready
+
+    :return: when it was seen and the time to ready main.py reported, in ms
+    """
+    found = {}
+
+    def reader():
+        for line in process.stdout:
+            if line.startswith('Ready in'):
+                found['time'] = time.perf_counter()
+                found['reported'] = float(line.split()[2])
+                return
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not found:
+        raise SystemExit(f'main.py was not ready within {timeout} s')
+    return found['time'], found['reported']
+
+
+def _wait_for_port(host, port, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.1).close()
+            return time.perf_counter()
+        except OSError:
+            time.sleep(0.001)
+    raise SystemExit(f'broker not accepting connections on {host}:{port}')
+
+
+def bench_startup(args):
+    """
+    Start main.py and time how long it takes to be ready to play. The broker is expected to be
+    running, or with ``--broker-cmd`` it is started ``--broker-delay`` seconds after the game, as
+    when the whole stack starts at once, and the time from the broker accepting connections is
+    reported.
+    """
+    directory = tempfile.mkdtemp()
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, 'config.yaml'), 'r') as configfile:
+        config = yaml.safe_load(configfile)
+    config['mqttbroker'].update(broker=args.host, port=args.port, transport=args.transport)
+    with open(os.path.join(directory, 'config.yaml'), 'w') as configfile:
+        yaml.safe_dump(config, configfile)
+
+    print(f'{"run":>4} {"launch to ready":>16} {"broker to ready":>16} {"reported":>9}')
+    for run in range(args.runs):
+        broker = None
+        launched = time.perf_counter()
+        game = subprocess.Popen([sys.executable, '-u', os.path.join(here, 'main.py')], cwd=directory,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            if args.broker_cmd:
+                time.sleep(args.broker_delay)
+                broker = subprocess.Popen(shlex.split(args.broker_cmd), stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.DEVNULL)
+                accepting = _wait_for_port(args.host, args.port)
+            else:
+                accepting = launched
+            ready, reported = _wait_for_ready(game, args.timeout)
+        finally:
+            game.terminate()
+            game.wait()
+            if broker is not None:
+                broker.terminate()
+                broker.wait()
+        print(f'{run:>4} {(ready - launched) * 1000:>13.0f} ms {(ready - accepting) * 1000:>13.0f} ms '
+              f'{reported:>6.0f} ms')
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+
+def attach(client: mqtt.Client, transport: str, loop: asyncio.AbstractEventLoop):
+    """
+    Run a client connected with ``connect_async`` the way main.py does for a transport
+
+    :return: a function that stops it
+    """
+    if transport == 'asyncio':
+        helper = AsyncioHelper(loop, client)
+        helper.start()
+        return helper.stop
+    client.loop_start()
+    return lambda: (client.disconnect(), client.loop_stop())
+
+
+async def _wait(event: asyncio.Event, what: str, timeout: float):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        raise SystemExit(f'FAILED: {what} within {timeout} s')
+    event.clear()
+
+
+async def _check_transport(args, broker: MiniBroker):
+    loop = asyncio.get_running_loop()
+    client = mqtt.Client('bench-transport')
+    subscribed = asyncio.Event()
+    all_received = asyncio.Event()
+    sent, received = {}, {}
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe('bench/#')
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        loop.call_soon_threadsafe(subscribed.set)
+
+    def on_message(client, userdata, msg):
+        received[msg.payload] = time.perf_counter()
+        if len(received) == len(sent):
+            loop.call_soon_threadsafe(all_received.set)
+
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.connect_async('127.0.0.1', broker.port, 60)
+    start = time.perf_counter()
+    stop = attach(client, args.transport, loop)
+    try:
+        await _wait(subscribed, 'connect and subscribe', args.timeout)
+        print(f'{"connect + subscribe":<24} {(time.perf_counter() - start) * 1000:>8.1f} ms')
+
+        async def publish_all(phase, publish):
+            sent.clear()
+            received.clear()
+            for n in range(args.messages):
+                payload = f'{phase} {n}'.encode()
+                sent[payload] = time.perf_counter()
+                publish(f'bench/{n}', payload, n % 2)
+            # nothing else runs on the loop, as when the game is in standby
+            await _wait(all_received, f'{phase}: {len(received)} of {len(sent)} messages received', args.timeout)
+            latencies = [(received[payload] - when) * 1000 for payload, when in sent.items()]
+            print(f'{phase:<24} {len(received):>5}/{len(sent):<5} p50 {_percentile(latencies, 0.5):>6.2f} ms '
+                  f'p99 {_percentile(latencies, 0.99):>6.2f} ms')
+
+        await publish_all('publish from the loop', client.publish)
+
+        def from_thread(topic, payload, qos):
+            threading.Thread(target=loop.call_soon_threadsafe, args=(client.publish, topic, payload, qos)).start()
+        await publish_all('publish from a thread', from_thread)
+
+        dropped = time.perf_counter()
+        broker.drop_clients()
+        await _wait(subscribed, 'reconnect and resubscribe after the broker dropped the connection', args.timeout)
+        print(f'{"reconnect + subscribe":<24} {(time.perf_counter() - dropped) * 1000:>8.1f} ms')
+        await publish_all('publish after reconnect', client.publish)
+    finally:
+        stop()
+    print(f'OK: {broker.connections} connections, {broker.published} messages through the broker')
+
+
+def bench_transport(args):
+    """
+    Check an MQTT transport against the in-process broker: connect and subscribe, publish at QoS 0
+    and 1 from the event loop and, through ``call_soon_threadsafe``, from other threads, then drop
+    the connection and check the client reconnects, resubscribes and still delivers
+    """
+    broker = MiniBroker()
+    broker.start()
+    try:
+        asyncio.run(_check_transport(args, broker))
+    finally:
+        broker.stop()
+
+
+async def _check_leaderboard(args, broker: MiniBroker):
+    loop = asyncio.get_running_loop()
+    game = mqtt.Client('bench-leaderboard')
+    service = LeaderboardService(LeaderboardStore(':memory:'), game, top=args.top)
+    game_subscribed, done = asyncio.Event(), asyncio.Event()
+    game.on_connect = lambda client, userdata, flags, rc: client.subscribe(
+        service.subscriptions() + [('game/leaderboard', 0)])
+    game.on_subscribe = lambda client, userdata, mid, granted_qos: loop.call_soon_threadsafe(game_subscribed.set)
+    game.message_callback_add('game/leaderboard', service.on_result)
+    game.message_callback_add(service.request_topic, service.on_request)
+    # the asyncio transport must only be used from the loop thread
+    loop_thread, off_loop = threading.get_ident(), []
+    publish = game.publish
+
+    def checked_publish(*args, **kwargs):
+        if threading.get_ident() != loop_thread:
+            off_loop.append(args[0])
+        return publish(*args, **kwargs)
+    game.publish = checked_publish
+    game.connect_async('127.0.0.1', broker.port, 60)
+    stop = attach(game, args.transport, loop)
+    service.start(None if args.from_thread else loop)
+
+    rng = random.Random(0)
+    scores = rng.sample(range(10000), args.results)
+    expected = {rank: [f'player{n}', score] for rank, (score, n) in
+                enumerate(sorted(((score, n) for n, score in enumerate(scores)), reverse=True)[:args.top], start=1)}
+    ranks, responses = {}, set()
+
+    def on_message(client, userdata, msg):
+        data = json.loads(msg.payload)
+        if msg.topic == service.response_topic:
+            responses.add(data['id'])
+        else:
+            ranks[int(msg.topic.rsplit('/', 1)[1])] = [data['user'], data['score']]
+        if len(responses) == args.requests and ranks == expected:
+            loop.call_soon_threadsafe(done.set)
+
+    player_subscribed = threading.Event()
+    player = mqtt.Client('bench-player')
+    player.on_message = on_message
+    player.on_subscribe = lambda client, userdata, mid, granted_qos: player_subscribed.set()
+    player.connect('127.0.0.1', broker.port, 60)
+    player.subscribe([(service.top_topic + '#', 0), (service.response_topic, 0)])
+    player.loop_start()
+    try:
+        await _wait(game_subscribed, 'the game connected and subscribed', args.timeout)
+        if not player_subscribed.wait(args.timeout):
+            raise SystemExit('FAILED: the player connected and subscribed')
+        start = time.perf_counter()
+        for n, score in enumerate(scores):
+            player.publish('game/leaderboard', json.dumps({'user': f'player{n}', 'score': score}))
+        for n in range(args.requests):
+            player.publish(service.request_topic, json.dumps({'query': 'top', 'n': args.top, 'id': n}))
+        # nothing else runs on the loop, so nothing else flushes the client's socket
+        await _wait(done, f'{len(responses)} of {args.requests} responses and {len(ranks)} of '
+                          f'{len(expected)} ranks ({sum(ranks.get(rank) == entry for rank, entry in expected.items())} '
+                          f'up to date) received', args.timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        player.loop_stop()
+        player.disconnect()
+        service.stop()
+        stop()
+    if off_loop:
+        raise SystemExit(f'FAILED: {len(off_loop)} messages published off the event loop thread, '
+                         f'e.g. on {off_loop[0]}')
+    print(f'OK: {args.results} results and {args.requests} queries answered in {elapsed * 1000:.0f} ms, '
+          f'top {args.top} up to date, over the {args.transport} transport')
+
+
+def bench_leaderboard_mqtt(args):
+    """
+    Run the leaderboard service over a transport against the in-process broker, with the event loop
+    otherwise idle, and check every query is answered, every rank of the top scores is published and
+    every message is published from the loop thread
+    """
+    broker = MiniBroker()
+    broker.start()
+    try:
+        asyncio.run(_check_leaderboard(args, broker))
+    finally:
+        broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cornhole game benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    interrupt = subparsers.add_parser('interrupt', help='CPU use and hit to score latency of a game')
+    interrupt.add_argument('--gametime', type=float, default=5)
+    interrupt.add_argument('--holes', type=int, default=5)
+    interrupt.add_argument('--hits', type=int, default=50)
+    interrupt.add_argument('--seed', type=int, default=0)
+    interrupt.add_argument('--status-window', type=float, default=0.05)
+    interrupt.set_defaults(func=bench_interrupt)
+
+    standby = subparsers.add_parser('standby', help='newgame command to game start latency')
+    standby.add_argument('--gametime', type=float, default=0.2)
+    standby.add_argument('--games', type=int, default=20)
+    standby.set_defaults(func=bench_standby)
+
+    reset = subparsers.add_parser('reset', help='cost of resetting between games')
+    reset.add_argument('--holes', type=int, default=5)
+    reset.add_argument('--resets', type=int, default=10000)
+    reset.set_defaults(func=bench_reset)
+
+    boards = subparsers.add_parser('boards', help='many boards in one process')
+    boards.add_argument('--boards', type=int, default=50)
+    boards.add_argument('--gametime', type=float, default=5)
+    boards.add_argument('--hits', type=int, default=1000)
+    boards.add_argument('--seed', type=int, default=0)
+    boards.set_defaults(func=bench_boards)
+
+    switches = subparsers.add_parser('switches', help='check no hits are lost under a flood of hits')
+    switches.add_argument('--gametime', type=float, default=4)
+    switches.add_argument('--threads', type=int, default=4)
+    switches.add_argument('--rate', type=float, default=2000, help='hits per second per thread')
+    switches.add_argument('--burst', type=int, default=20, help='hits sent back to back')
+    switches.set_defaults(func=bench_switches)
+
+    holes = subparsers.add_parser('holes', help='scaling with the number of holes, in virtual time')
+    holes.add_argument('--holes', type=int, nargs='+', default=[5, 50, 500])
+    holes.add_argument('--gametime', type=float, default=120)
+    holes.add_argument('--games', type=int, default=3)
+    holes.add_argument('--seed', type=int, default=0)
+    holes.set_defaults(func=bench_holes)
+
+    logs = subparsers.add_parser('logging', help='event loop lag with logging off, synchronous and queued')
+    logs.add_argument('--gametime', type=float, default=4)
+    logs.add_argument('--rate', type=float, default=500, help='switch messages per second')
+    logs.add_argument('--disk-delay', type=float, default=0, help='extra milliseconds to write each record')
+    logs.set_defaults(func=bench_logging)
+
+    reload = subparsers.add_parser('reload', help='configuration changes applied during a game')
+    reload.add_argument('--gametime', type=float, default=4)
+    reload.add_argument('--reloads', type=int, default=20)
+    reload.add_argument('--interval', type=float, default=0.05, help='seconds between checks of the file')
+    reload.add_argument('--rate', type=float, default=1000, help='switch messages per second')
+    reload.set_defaults(func=bench_reload)
+
+    leaderboard = subparsers.add_parser('leaderboard', help='leaderboard database as the number of games grows')
+    leaderboard.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 300000])
+    leaderboard.add_argument('--adds', type=int, default=200)
+    leaderboard.add_argument('--queries', type=int, default=200)
+    leaderboard.set_defaults(func=bench_leaderboard)
+
+    leaderboard_mqtt = subparsers.add_parser('leaderboard-mqtt',
+                                             help='leaderboard service over a transport, against an in-process broker')
+    leaderboard_mqtt.add_argument('--transport', default='asyncio', choices=['thread', 'asyncio'])
+    leaderboard_mqtt.add_argument('--results', type=int, default=500)
+    leaderboard_mqtt.add_argument('--requests', type=int, default=200)
+    leaderboard_mqtt.add_argument('--top', type=int, default=10)
+    leaderboard_mqtt.add_argument('--timeout', type=float, default=10)
+    leaderboard_mqtt.add_argument('--from-thread', action='store_true',
+                                  help='publish from the database thread, which the check should fail')
+    leaderboard_mqtt.set_defaults(func=bench_leaderboard_mqtt)
+
+    journal = subparsers.add_parser('journal', help='event journal write throughput')
+    journal.add_argument('--dir', default=None, help='directory on the storage to test, e.g. the SD card')
+    journal.add_argument('--records', type=int, default=200000)
+    journal.add_argument('--unbuffered', type=int, default=2000, help='records written with an fsync each')
+    journal.add_argument('--fsync-intervals', type=float, nargs='+', default=[0.01, 0.1, 1])
+    journal.set_defaults(func=bench_journal)
+
+    startup = subparsers.add_parser('startup', help='time for main.py to be ready to play')
+    startup.add_argument('--host', default='127.0.0.1')
+    startup.add_argument('--port', type=int, default=1883)
+    startup.add_argument('--transport', default='thread', choices=['thread', 'asyncio'])
+    startup.add_argument('--broker-cmd', default=None, help='command to start the broker, e.g. "mosquitto -p 1883"')
+    startup.add_argument('--broker-delay', type=float, default=1, help='seconds between starting the game and the broker')
+    startup.add_argument('--runs', type=int, default=3)
+    startup.add_argument('--timeout', type=float, default=30)
+    startup.set_defaults(func=bench_startup)
+
+    transport = subparsers.add_parser('transport', help='MQTT transport against an in-process broker')
+    transport.add_argument('--transport', default='asyncio', choices=['thread', 'asyncio'])
+    transport.add_argument('--messages', type=int, default=1000)
+    transport.add_argument('--timeout', type=float, default=10)
+    transport.set_defaults(func=bench_transport)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Runs several games, one per physical board, in one process. The games share a single MQTT client
+and event loop, each board's topics are namespaced as ``board/<id>/...``, e.g.
+``board/3/game/status`` and ``board/3/switch/2``.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from make_game import MakeGame
+from journal import open_journal
+from checkpoint import open_checkpoint
+
+
+class Boards:
+    """
+    Games for a set of boards
+
+    Args:
+        configdata: game settings from the configuration file, shared by every board
+        mqtt_client: mqtt client instance
+        board_ids: ids of the boards
+        journalsettings: the ``journal`` section of the configuration file, to journal each board
+        checkpointsettings: the ``checkpoint`` section of the configuration file
+    """
+    topics = ('game', 'switch', 'ui', 'twitter')
+
+    def __init__(self, configdata, mqtt_client: mqtt.Client, board_ids, journalsettings=None,
+                 checkpointsettings=None):
+        self.mqtt: mqtt.Client = mqtt_client
+        self.games = {str(board): MakeGame(configdata, mqtt_client, board=board,
+                                           journal=open_journal(journalsettings or {}, board),
+                                           checkpoint=open_checkpoint(checkpointsettings or {}, board))
+                      for board in board_ids}
+
+    def subscriptions(self) -> list[tuple[str, int]]:
+        return [(f'board/+/{topic}/#', 0) for topic in self.topics]
+
+    def route(self, msg):
+        """
+        Find the game a message is for
+
+        :return: the game and a copy of the message with the board prefix removed from the topic,
+            or None if the board is unknown
+        """
+        _, board, topic = msg.topic.split('/', 2)
+        game = self.games.get(board)
+        if game is None:
+            return None
+        return game, SimpleNamespace(topic=topic, payload=msg.payload)
+
+    def __iter__(self):
+        return iter(self.games.values())
+
+    def __len__(self):
+        return len(self.games)
+
+    async def main(self):
+        await asyncio.gather(*(game.main() for game in self.games.values()))
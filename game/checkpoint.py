@@ -0,0 +1,116 @@
+"""
+Checkpoints of the game in play, so a game survives a restart of the game service. The state is
+written as json to a temporary file which is then renamed over the checkpoint, so the checkpoint
+on disk is always complete, either the old state or the new one.
+
+The writes happen on a thread of their own, only the latest state is written if several are
+saved while a write is in progress.
+"""
+import json
+import logging
+import os
+import threading
+
+_DELETE = object()
+
+
+class Checkpoint:
+    """
+    The checkpoint file of a game
+
+    Args:
+        path: the checkpoint file, the directory is created if need be
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='checkpoint', daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """
+        The last state saved, or None if there is no checkpoint or it cannot be read
+        """
+        try:
+            with open(self.path, 'r') as checkpoint:
+                return json.load(checkpoint)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring checkpoint %s: %s', self.path, e)
+            return None
+
+    def save(self, state: dict):
+        """
+        Save the state, safe to call from any thread
+        """
+        with self._lock:
+            self._pending = state
+            self._wakeup.notify()
+
+    def clear(self):
+        """
+        Remove the checkpoint, once the game it is for has ended
+        """
+        self.save(_DELETE)
+
+    def _write(self, state):
+        if state is _DELETE:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self.path)
+        self.writes += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._pending is None and not self._closed:
+                    self._wakeup.wait()
+                state, self._pending = self._pending, None
+                closed = self._closed
+            if state is not None:
+                try:
+                    self._write(state)
+                except OSError as e:
+                    logging.error('Checkpoint %s could not be written: %s', self.path, e)
+            if closed:
+                return
+
+    def close(self):
+        """
+        Write any pending state and stop the writer
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+
+
+def open_checkpoint(settings: dict, board=None):
+    """
+    The checkpoint for a game from the ``checkpoint`` section of the configuration file, each
+    board has a file of its own
+
+    :return: the checkpoint, or None if checkpointing is not enabled
+    """
+    if not settings.get('enabled', False):
+        return None
+    path = settings.get('path', 'checkpoint.json')
+    if board is not None:
+        root, extension = os.path.splitext(path)
+        path = f'{root}-board-{board}{extension}'
+    return Checkpoint(path)
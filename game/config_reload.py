@@ -0,0 +1,156 @@
+"""
+Reloads the game settings while the game service is running. The configuration file is polled for
+a change to its modification time, or reloaded on the ``reconfig`` control message, and the new
+settings are checked then applied in place to the running games with :meth:`MakeGame.reconfigure`.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import paho.mqtt.client as mqtt
+import yaml
+
+from make_game import _signal, _GameHole
+from stats import Histogram, LATENCY_BUCKETS_MS
+
+#: libyaml's loader when it is available, it parses the file several times faster
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+#: settings that only take effect when the service is restarted
+RESTART_SETTINGS = ('boards',)
+
+
+def validate(gamesettings) -> dict:
+    """
+    Check the ``gamesettings`` section of the configuration file
+
+    :return: the settings
+    :raises ValueError: describing the first problem found
+    """
+    if not isinstance(gamesettings, dict):
+        raise ValueError('gamesettings should be a mapping')
+    for key in ('colours', 'nHoles', 'hole_scores', 'difficulty', 'gametime', 'bonusMult', 'holeconfig'):
+        if key not in gamesettings:
+            raise ValueError(f'gamesettings.{key} is missing')
+    try:
+        nholes = int(gamesettings['nHoles'])
+        scores = [int(x) for x in gamesettings['hole_scores']]
+        int(gamesettings['bonusMult'])
+        gametime = float(gamesettings['gametime'])
+        holeconfig = {key: float(gamesettings['holeconfig'][key]) for key in
+                      ('prob_on', 'min_on_time', 'max_on_time', 'min_off_time', 'max_off_time')}
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f'gamesettings has a bad value: {e!r}')
+    if nholes < 1:
+        raise ValueError('gamesettings.nHoles should be at least 1')
+    if len(scores) < nholes:
+        raise ValueError(f'gamesettings.hole_scores has {len(scores)} scores for {nholes} holes')
+    if gametime <= 0:
+        raise ValueError('gamesettings.gametime should be positive')
+    if not gamesettings['colours']:
+        raise ValueError('gamesettings.colours should list at least one colour')
+    if not 0 <= holeconfig['prob_on'] <= 1:
+        raise ValueError('gamesettings.holeconfig.prob_on should be between 0 and 1')
+    if holeconfig['min_on_time'] > holeconfig['max_on_time'] or \
+            holeconfig['min_off_time'] > holeconfig['max_off_time']:
+        raise ValueError('gamesettings.holeconfig minimum times should not exceed the maximums')
+    if gamesettings.get('hole_encoding', 'json') not in _GameHole.encodings:
+        raise ValueError(f'gamesettings.hole_encoding should be one of {_GameHole.encodings}')
+    return gamesettings
+
+
+class ConfigWatcher:
+    """
+    Watch the configuration file and apply changes to the game settings to the running games
+
+    Args:
+        path: the configuration file
+        games: the games run by this process
+        mqtt_client: mqtt client instance, used to republish changed switch settings
+        interval: seconds between checks of the file, 0 to only reload when asked to
+    """
+    def __init__(self, path: str, games, mqtt_client: mqtt.Client, interval: float = 1):
+        self.path = path
+        self.games = list(games)
+        self.mqtt: mqtt.Client = mqtt_client
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self.reload_latency = Histogram(LATENCY_BUCKETS_MS)
+        self._mtime = self._stat()
+        self._switchsettings = None
+        self._loop = None
+        self._requested = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def request_reload(self):
+        """
+        Reload the configuration file now, safe to call from the MQTT network thread
+        """
+        _signal(self._loop, self._requested)
+
+    def reload(self) -> set[str]:
+        """
+        Read the configuration file and apply the game settings that changed to every game
+
+        :return: names of the settings that changed, nothing is applied if the file is invalid
+        """
+        start = time.perf_counter()
+        try:
+            with open(self.path, 'r') as configfile:
+                config = yaml.load(configfile, Loader=_Loader)
+            gamesettings = validate(config.get('gamesettings') if isinstance(config, dict) else None)
+        except (OSError, yaml.YAMLError, ValueError) as e:
+            self.failures += 1
+            logging.error('Configuration not reloaded from %s: %s', self.path, e)
+            return set()
+
+        changed = set()
+        for game in self.games:
+            changed |= game.reconfigure(gamesettings)
+        for key in changed & set(RESTART_SETTINGS):
+            logging.warning('gamesettings.%s changed, it takes effect when the game is restarted', key)
+
+        switchsettings = config.get('switchsettings')
+        if switchsettings and switchsettings != self._switchsettings:
+            if self._switchsettings is not None:
+                for game in self.games:
+                    for key in ('interval', 'hold_off'):
+                        self.mqtt.publish(game.prefix + 'switch/' + key, switchsettings[key], retain=True)
+                changed.add('switchsettings')
+            self._switchsettings = switchsettings
+
+        elapsed = time.perf_counter() - start
+        self.reload_latency.observe(elapsed * 1000)
+        self.reloads += 1
+        logging.info('Configuration reloaded in %.2f ms, changed: %s', elapsed * 1000, sorted(changed))
+        return changed
+
+    async def run(self):
+        """
+        Watch for changes until cancelled
+        """
+        self._loop = asyncio.get_running_loop()
+        self._requested = asyncio.Event()
+        # the switch settings already published at start up
+        with open(self.path, 'r') as configfile:
+            self._switchsettings = (yaml.load(configfile, Loader=_Loader) or {}).get('switchsettings')
+        while True:
+            try:
+                await asyncio.wait_for(self._requested.wait(), timeout=self.interval or None)
+            except asyncio.TimeoutError:
+                mtime = self._stat()
+                if mtime == self._mtime:
+                    continue
+                self._mtime = mtime
+            else:
+                self._requested.clear()
+                self._mtime = self._stat()
+            self.reload()
@@ -0,0 +1,81 @@
+"""
+Precomputed hole timelines. Rather than drawing random numbers every time a hole changes, the whole
+sequence of on/off states, colours and durations for a game is generated up front from a seed, so
+a game can be replayed exactly and the upcoming light states can be published in advance.
+"""
+from math import ceil
+
+import numpy as np
+
+
+class HoleSchedule:
+    """
+    Timeline of one hole, a sequence of (status, colour, duration) cycles that is extended if the
+    game runs past the end of it
+
+    Args:
+        seed: seed sequence for this hole
+        holeconfig: hole configuration from the configuration file
+        colour_list: colours the hole can be lit with
+        cycles: number of cycles to generate at a time
+    """
+    __slots__ = ('rng', 'holeconfig', 'colour_list', 'cycles', 'status', 'colour', 'duration', 'position')
+
+    def __init__(self, seed: np.random.SeedSequence, holeconfig: dict, colour_list: list[str], cycles: int):
+        self.rng = np.random.default_rng(seed)
+        self.holeconfig = holeconfig
+        self.colour_list = colour_list
+        self.cycles = cycles
+        self.status = []
+        self.colour = []
+        self.duration = []
+        self.position = 0
+        self.extend()
+
+    def extend(self):
+        """
+        Generate the next block of cycles
+        """
+        on = self.rng.random(self.cycles) <= self.holeconfig['prob_on']
+        colour = self.rng.integers(len(self.colour_list), size=self.cycles)
+        duration = np.where(on,
+                            self.rng.uniform(self.holeconfig['min_on_time'], self.holeconfig['max_on_time'], self.cycles),
+                            self.rng.uniform(self.holeconfig['min_off_time'], self.holeconfig['max_off_time'], self.cycles))
+        # plain python values, so the replay does no numpy work and the values serialise to json
+        self.status += on.tolist()
+        self.colour += [self.colour_list[i] for i in colour.tolist()]
+        self.duration += duration.tolist()
+
+    def next(self) -> tuple[bool, str, float]:
+        """
+        The next cycle of the timeline
+        """
+        if self.position == len(self.status):
+            self.extend()
+        i = self.position
+        self.position += 1
+        return self.status[i], self.colour[i], self.duration[i]
+
+    def upcoming(self, start: int = None) -> list:
+        """
+        Cycles not yet played, or those from ``start`` on, as [status, colour, duration] lists
+        """
+        return [[self.status[i], self.colour[i] if self.status[i] else 'off', round(self.duration[i], 3)]
+                for i in range(self.position if start is None else start, len(self.status))]
+
+
+def generate(seed: int, holeconfig: dict, colour_list: list[str], nholes: int, gametime: float) -> list[HoleSchedule]:
+    """
+    Generate the timelines for every hole in a game
+
+    Args:
+        seed: seed for the game
+        holeconfig: hole configuration from the configuration file
+        colour_list: colours the holes can be lit with
+        nholes: number of holes
+        gametime: length of the game in seconds, used to size the timelines
+    """
+    shortest = max(min(holeconfig['min_on_time'], holeconfig['min_off_time']), 0.1)
+    cycles = ceil(gametime / shortest) + 1
+    return [HoleSchedule(hole_seed, holeconfig, colour_list, cycles)
+            for hole_seed in np.random.SeedSequence(seed).spawn(nholes)]
@@ -0,0 +1,250 @@
+"""
+Append-only journal of everything that happens in a game: hole changes, switch hits, score
+changes, commands, and the start and end of each game. Replay a journal with ``replay.py``.
+
+The journal is a directory of segment files, ``00000001.journal``, ``00000002.journal``, ..., a
+new segment is started once the current one reaches ``segment_bytes``. Each record is::
+
+    length (uint32)  crc32 (uint32)  time (float64)  kind (uint8)  fields...
+
+little endian, where ``length`` and the crc cover everything after the crc. Numeric fields are
+packed as given in :data:`KINDS`, followed by any strings, each as a uint16 length and utf-8.
+A record torn by a crash fails its crc and ends the replay of its segment.
+
+Records are appended to a buffer, which a background thread writes out and fsyncs every
+``fsync_interval`` seconds, so the game never waits on the disk.
+
+Records take 25 to 40 bytes, a game a few kilobytes. Whenever a segment is started the oldest
+segments are deleted, beyond ``max_segments`` or last written more than ``max_age_days`` ago, so
+the journal never fills the disk.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+HOLE, SWITCH, SCORE, COMMAND, GAME_START, GAME_END = range(1, 7)
+
+#: the numeric fields, as a struct format, and the names of the numeric then string fields of
+#: each kind of record
+KINDS = {
+    HOLE: ('<H?', ('hole', 'status', 'colour')),
+    SWITCH: ('<H?d', ('hole', 'bonus', 'hit_time')),
+    SCORE: ('<Hqq', ('hole', 'points', 'score')),
+    COMMAND: ('<', ('command',)),
+    GAME_START: ('<d', ('finish_time', 'username')),
+    GAME_END: ('<q?', ('score', 'twitter_follower', 'username')),
+}
+
+KIND_NAMES = {HOLE: 'hole', SWITCH: 'switch', SCORE: 'score', COMMAND: 'command',
+              GAME_START: 'game_start', GAME_END: 'game_end'}
+
+_HEADER = struct.Struct('<II')
+_STAMP = struct.Struct('<dB')
+_LENGTH = struct.Struct('<H')
+_FIELDS = {kind: struct.Struct(fmt) for kind, (fmt, _) in KINDS.items()}
+
+SEGMENT_SUFFIX = '.journal'
+
+
+def encode(when: float, kind: int, *fields) -> bytes:
+    """
+    A journal record
+    """
+    packer = _FIELDS[kind]
+    numeric = len(KINDS[kind][0]) - 1
+    body = [_STAMP.pack(when, kind), packer.pack(*fields[:numeric])]
+    for text in fields[numeric:]:
+        data = str(text).encode('utf-8')
+        body.append(_LENGTH.pack(len(data)))
+        body.append(data)
+    body = b''.join(body)
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode(body: bytes) -> tuple[float, int, tuple]:
+    """
+    The time, kind and fields of a record, from the bytes after the crc
+    """
+    when, kind = _STAMP.unpack_from(body)
+    offset = _STAMP.size
+    packer = _FIELDS[kind]
+    fields = list(packer.unpack_from(body, offset))
+    offset += packer.size
+    while offset < len(body):
+        length, = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        fields.append(body[offset:offset + length].decode('utf-8'))
+        offset += length
+    return when, kind, tuple(fields)
+
+
+def segments(directory: str) -> list[str]:
+    """
+    The segment files of a journal, oldest first
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith(SEGMENT_SUFFIX)]
+
+
+def read(directory: str):
+    """
+    Iterate over the records of a journal, as ``(time, kind, fields)``
+    """
+    for path in segments(directory):
+        with open(path, 'rb') as segment:
+            data = segment.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            body = data[offset + _HEADER.size:offset + _HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                logging.warning('Journal segment %s is torn at byte %s', path, offset)
+                break
+            yield decode(body)
+            offset += _HEADER.size + length
+
+
+class Journal:
+    """
+    Writes game events to a journal directory
+
+    Args:
+        directory: where the segment files are kept, created if need be
+        segment_bytes: size at which a new segment is started
+        fsync_interval: seconds between writes of the buffered records to disk
+        max_segments: segments kept, including the one being written, None to keep them all
+        max_age_days: days after their last write that segments are kept, None to keep them all
+    """
+    def __init__(self, directory: str, segment_bytes: int = 16 << 20, fsync_interval: float = 1.0,
+                 max_segments: int = None, max_age_days: float = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.max_segments = max_segments
+        self.max_age_days = max_age_days
+        self.records = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = segments(directory)
+        self._number = int(os.path.basename(existing[-1])[:-len(SEGMENT_SUFFIX)]) if existing else 0
+        self._file = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        # always start a new segment, the last one may end in a record torn by a crash
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='journal', daemon=True)
+        self._thread.start()
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._number += 1
+        path = os.path.join(self.directory, f'{self._number:08d}{SEGMENT_SUFFIX}')
+        self._file = open(path, 'ab')
+        self.prune()
+
+    def prune(self):
+        """
+        Delete the segments beyond ``max_segments`` and those older than ``max_age_days``, never
+        the one being written, and the empty segments left by restarts
+        """
+        old = segments(self.directory)[:-1]
+        keep = len(old) if self.max_segments is None else max(self.max_segments - 1, 0)
+        expired = None if self.max_age_days is None else time.time() - self.max_age_days * 86400
+        for index, path in enumerate(old):
+            try:
+                if index < len(old) - keep or os.path.getsize(path) == 0 or \
+                        (expired is not None and os.path.getmtime(path) < expired):
+                    os.remove(path)
+            except OSError as e:
+                logging.error('Journal segment %s could not be deleted: %s', path, e)
+
+    def record(self, when: float, kind: int, *fields):
+        """
+        Append a record, safe to call from any thread
+        """
+        data = encode(when, kind, *fields)
+        with self._lock:
+            self._buffer.append(data)
+            self.records += 1
+
+    def hole(self, when: float, hole: int, status: bool, colour: str):
+        self.record(when, HOLE, hole, status, colour)
+
+    def switch(self, when: float, hole: int, bonus: bool, hit_time: float = None):
+        self.record(when, SWITCH, hole, bonus, math.nan if hit_time is None else hit_time)
+
+    def score(self, when: float, hole: int, points: int, score: int):
+        self.record(when, SCORE, hole, points, score)
+
+    def command(self, when: float, command: str):
+        self.record(when, COMMAND, command)
+
+    def flush(self):
+        """
+        Write the buffered records to disk and fsync them
+        """
+        with self._write_lock:
+            with self._lock:
+                buffer, self._buffer = self._buffer, []
+            if not buffer:
+                return
+            data = b''.join(buffer)
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.bytes_written += len(data)
+            self.syncs += 1
+            if self._file.tell() >= self.segment_bytes:
+                self._open_segment()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._wakeup.wait(self.fsync_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error('Journal %s could not be written: %s', self.directory, e)
+            if closed:
+                return
+
+    def close(self):
+        """
+        Write out everything recorded and stop the writer
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._file.close()
+
+
+def open_journal(settings: dict, board=None):
+    """
+    The journal for a game from the ``journal`` section of the configuration file, each board
+    has a directory of its own
+
+    :return: the journal, or None if journalling is not enabled
+    """
+    if not settings.get('enabled', False):
+        return None
+    directory = os.path.join(settings.get('directory', 'journal'), 'game' if board is None else f'board-{board}')
+    max_segments = settings.get('max_segments')
+    max_age_days = settings.get('max_age_days')
+    return Journal(directory, segment_bytes=int(float(settings.get('segment_mb', 16)) * (1 << 20)),
+                   fsync_interval=float(settings.get('fsync_interval', 1)),
+                   max_segments=None if max_segments is None else int(max_segments),
+                   max_age_days=None if max_age_days is None else float(max_age_days))
@@ -0,0 +1,264 @@
+"""
+Persistent leaderboard, kept in an SQLite database. Results published on ``game/leaderboard`` (and
+``board/<id>/game/leaderboard``) are stored, and queries sent to ``leaderboard/request`` are
+answered on the topic named in the request::
+
+    {"query": "top", "n": 10, "id": "abc", "reply_to": "dashboard/leaderboard"}
+
+Queries are ``top`` (best ``n`` scores ever), ``today`` (best ``n`` scores today) and ``player``
+(the best score of ``user``). The response carries the request ``id`` and a list of ``results``,
+each ``{"user": .., "score": .., "time": .., "board": ..}``.
+
+The best scores are also kept in memory and published, retained, one rank per topic on
+``game/leaderboard/top/<rank>`` as ``{"user": .., "score": .., "time": ..}``. When a game makes
+the table only the ranks that changed are published, so a dashboard subscribed to
+``game/leaderboard/top/#`` is sent the whole table once and then just the changes.
+
+The database is written from a thread of its own so a slow disk never holds up the game. Its
+messages are published from the game's event loop, as the asyncio transport is not safe to publish
+on from other threads.
+"""
+import asyncio
+import bisect
+import datetime
+import functools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    board TEXT,
+    user TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    twitter_follower INTEGER NOT NULL DEFAULT 0,
+    time REAL NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_score ON games (score DESC, time);
+CREATE INDEX IF NOT EXISTS games_by_user ON games (user, score DESC, time);
+CREATE INDEX IF NOT EXISTS games_by_day ON games (day, score DESC, time);
+'''
+
+_COLUMNS = 'user, score, time, board'
+
+
+class LeaderboardStore:
+    """
+    Games results in an SQLite database, every query is answered from an index so the cost of
+    adding a result or reading the top scores grows only with the log of the number of games
+
+    Args:
+        path: database file, ``:memory:`` for a database that is not kept
+    """
+    def __init__(self, path: str = 'leaderboard.db'):
+        self.path = path
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def add(self, user: str, score: int, twitter_follower: bool = False, board=None, when: float = None):
+        """
+        Record a game result, call :meth:`commit` to write it to the database
+        """
+        when = time.time() if when is None else when
+        self.db.execute('INSERT INTO games (board, user, score, twitter_follower, time, day) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (None if board is None else str(board), user, int(score), int(bool(twitter_follower)),
+                         when, datetime.date.fromtimestamp(when).isoformat()))
+
+    def commit(self):
+        self.db.commit()
+
+    @staticmethod
+    def _results(rows) -> list[dict]:
+        return [{'user': user, 'score': score, 'time': when, 'board': board} for user, score, when, board in rows]
+
+    def top(self, n: int = 10) -> list[dict]:
+        """
+        The best ``n`` scores ever, earlier games first among equal scores
+        """
+        return self._results(self.db.execute(
+            f'SELECT {_COLUMNS} FROM games ORDER BY score DESC, time LIMIT ?', (n,)))
+
+    def today(self, n: int = 10, day: datetime.date = None) -> list[dict]:
+        """
+        The best ``n`` scores of a day, today by default
+        """
+        day = (day or datetime.date.today()).isoformat()
+        return self._results(self.db.execute(
+            f'SELECT {_COLUMNS} FROM games WHERE day = ? ORDER BY score DESC, time LIMIT ?', (day, n)))
+
+    def player(self, user: str) -> list[dict]:
+        """
+        The best score of a player, an empty list if they have not played
+        """
+        return self._results(self.db.execute(
+            f'SELECT {_COLUMNS} FROM games WHERE user = ? ORDER BY score DESC, time LIMIT 1', (user,)))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class TopScores:
+    """
+    The best ``n`` scores, kept sorted in memory, earlier games first among equal scores
+
+    Args:
+        n: number of scores kept
+    """
+    def __init__(self, n: int = 10):
+        self.n = n
+        self.entries = []
+
+    def add(self, user: str, score: int, when: float) -> dict[int, dict]:
+        """
+        Add a game result
+
+        :return: the entries at the ranks that changed, keyed by rank from 1
+        """
+        entry = (-int(score), when, user)
+        index = bisect.bisect_right(self.entries, entry)
+        if index >= self.n:
+            return {}
+        self.entries.insert(index, entry)
+        del self.entries[self.n:]
+        # the new entry and everything below it moved down a place
+        return {rank + 1: self.entry(rank) for rank in range(index, len(self.entries))}
+
+    def entry(self, rank: int) -> dict:
+        score, when, user = self.entries[rank]
+        return {'user': user, 'score': -score, 'time': when}
+
+    def __iter__(self):
+        return (self.entry(rank) for rank in range(len(self.entries)))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LeaderboardService:
+    """
+    Stores the results of games and answers leaderboard queries over MQTT
+
+    Args:
+        store: the leaderboard database
+        mqtt_client: mqtt client instance, for the responses
+        top: number of ranks published on ``game/leaderboard/top/<rank>``
+    """
+    request_topic = 'leaderboard/request'
+    response_topic = 'leaderboard/response'
+    top_topic = 'game/leaderboard/top/'
+    queries = ('top', 'today', 'player')
+
+    def __init__(self, store: LeaderboardStore, mqtt_client: mqtt.Client, top: int = 10):
+        self.store = store
+        self.mqtt: mqtt.Client = mqtt_client
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.loop = None
+        self.top = TopScores(top)
+        for result in store.top(top):
+            self.top.add(result['user'], result['score'], result['time'])
+
+    def subscriptions(self) -> list[tuple[str, int]]:
+        return [(self.request_topic, 0)]
+
+    def on_result(self, client, userdata, msg):
+        """
+        Message callback for ``game/leaderboard`` and ``board/+/game/leaderboard``
+        """
+        board = msg.topic.split('/')[1] if msg.topic.startswith('board/') else None
+        self.queue.put(('result', board, msg.payload, time.time()))
+
+    def on_request(self, client, userdata, msg):
+        """
+        Message callback for ``leaderboard/request``
+        """
+        self.queue.put(('request', None, msg.payload, None))
+
+    def publish_top(self):
+        """
+        Publish the whole of the top scores table, e.g. on connecting to the broker
+        """
+        self.queue.put(('top', None, None, None))
+
+    def _publish(self, topic: str, payload: str, retain: bool = False):
+        publish = functools.partial(self.mqtt.publish, topic, payload, retain=retain)
+        if self.loop is None:
+            publish()
+        else:
+            self.loop.call_soon_threadsafe(publish)
+
+    def _publish_ranks(self, ranks: dict[int, dict]):
+        for rank, entry in ranks.items():
+            self._publish(self.top_topic + str(rank), json.dumps(entry), retain=True)
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Start the database thread
+
+        :param loop: the event loop the MQTT client runs on, messages are published from it, or
+            from the database thread if None
+        """
+        self.loop = loop
+        self.thread = threading.Thread(target=self.run, name='leaderboard', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            # write everything that has arrived in one transaction
+            while not self.queue.empty():
+                items.append(self.queue.get())
+            for item in items:
+                if item is None:
+                    self.store.commit()
+                    return
+                try:
+                    self.handle(*item)
+                except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                    logging.error('Leaderboard could not handle %s: %s', item, e)
+            self.store.commit()
+
+    def handle(self, kind, board, payload, received):
+        if kind == 'top':
+            self._publish_ranks(dict(enumerate(self.top, start=1)))
+            return
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        data = json.loads(payload)
+        if kind == 'result':
+            self.store.add(data['user'], data['score'], data.get('twitter_follower', False), board, received)
+            self._publish_ranks(self.top.add(data['user'], data['score'], received))
+            return
+        query = data.get('query', 'top')
+        if query not in self.queries:
+            raise ValueError(f'unknown query {query}, should be one of {self.queries}')
+        # answer with any results received so far
+        self.store.commit()
+        if query == 'player':
+            results = self.store.player(data['user'])
+        else:
+            results = getattr(self.store, query)(int(data.get('n', 10)))
+        self._publish(data.get('reply_to', self.response_topic),
+                      json.dumps({'id': data.get('id'), 'query': query, 'results': results}))
@@ -1,11 +1,14 @@
 """
 This module manages the the game instance and handles the MQTT connection and inbound messages
 """
-import json
 import time
+# start up is timed from here, see startup_step
+STARTED = time.perf_counter()
+import json
 import logging.config
 import uuid
 import asyncio
+import threading
 from os.path import exists
 import argparse
 
@@ -13,6 +16,12 @@ import yaml
 import paho.mqtt.client as mqtt
 
 from make_game import MakeGame as Game
+from boards import Boards
+from asyncio_mqtt import AsyncioHelper
+from config_reload import ConfigWatcher
+from journal import open_journal
+from checkpoint import open_checkpoint
+import queue_logging
 
 
 def readconfigfile(inputfile):
@@ -24,10 +33,34 @@ def readconfigfile(inputfile):
             gamesettings = config['gamesettings']
             switchsettings = config['switchsettings']
             logconf = config['logs']
+            metricsettings = config.get('metrics') or {}
+            leaderboardsettings = config.get('leaderboard') or {}
+            journalsettings = config.get('journal') or {}
+            checkpointsettings = config.get('checkpoint') or {}
         except Exception as e:
             logging.error(e)
     logging.debug(configfile)
-    return mqttbroker, gamesettings, switchsettings, logconf
+    return (mqttbroker, gamesettings, switchsettings, logconf, metricsettings, leaderboardsettings, journalsettings,
+            checkpointsettings)
+
+
+startup = {}
+_startup_lock = threading.Lock()
+
+
+def startup_step(step: str):
+    """
+    Note the time a step of starting up was reached, ``connected`` (to the broker) and ``running``
+    (the game loop), and report the time to ready once both have been
+    """
+    with _startup_lock:
+        startup.setdefault(step, time.perf_counter() - STARTED)
+        if 'ready' in startup or 'connected' not in startup or 'running' not in startup:
+            return
+        startup['ready'] = max(startup['connected'], startup['running'])
+    logging.info('Ready to play %.0f ms after starting, connected to the broker after %.0f ms',
+                 startup['ready'] * 1000, startup['connected'] * 1000)
+    print(f'Ready in {startup["ready"] * 1000:.0f} ms')
 
 
 #MQTT client callback Functions
@@ -35,8 +68,10 @@ def readconfigfile(inputfile):
 # Callback Functions - called on mqtt connection events
 # callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    global newgame
-    newgame.shutdown_request = False
+    for game in games:
+        game.shutdown_request = False
+        # the state published before connecting, e.g. of a resumed game, never reached the broker
+        game.republish()
     if rc == 0:
         logging.info("Successfully connected to broker")
     print("Connected with result code "+str(rc))
@@ -44,19 +79,31 @@ def on_connect(client, userdata, flags, rc):
     # Subscribing in on_connect() means that if we lose the connection and
     # reconnect then subscriptions will be renewed.
 
-    client.subscribe([("game/#", 0), ("switch/#", 0), ("ui/#", 0), ("twitter/#", 0)])
+    if boards is not None:
+        client.subscribe(boards.subscriptions())
+    else:
+        client.subscribe([("game/#", 0), ("switch/#", 0), ("ui/#", 0), ("twitter/#", 0)])
+    if leaderboard is not None:
+        client.subscribe(leaderboard.subscriptions())
+        leaderboard.publish_top()
+    # configure the switches, only once connected as anything published before is lost
+    for game in games:
+        client.publish(game.prefix + 'switch/interval', switchsettings['interval'], retain=True)
+        client.publish(game.prefix + 'switch/hold_off', switchsettings['hold_off'], retain=True)
+    if rc == 0:
+        startup_step('connected')
 
 # The callbacks for when a PUBLISH message is received from the server.
 def on_message(client, newgame, msg):
     msg.payload = str(msg.payload.decode("utf-8"))
-    logging.debug(msg.topic +" "+ msg.payload) 
-    logging.error("Unrecognised Payload:" + str(msg))
+    logging.debug('%s %s', msg.topic, msg.payload)
+    logging.error('Unrecognised Payload: %s', msg)
     if msg.topic == 'game/status':
         return True
 
 def on_control_message(client, newgame, msg):
     msg.payload = str(msg.payload.decode("utf-8"))
-    logging.debug(msg.topic + " "+ msg.payload) 
+    logging.debug('%s %s', msg.topic, msg.payload)
     if msg.topic == "game/control":# and not gamethread.is_alive():                                                          
         if msg.payload == 'reset':
             newgame.reset()
@@ -65,18 +112,17 @@ def on_control_message(client, newgame, msg):
             newgame.command = 'run' 
             newgame.publish()
         elif msg.payload == 'reconfig':
-            _, gamesettings, _, _ = readconfigfile('config.yaml')
-            newgame = Game(gamesettings, client)
+            watcher.request_reload()
         elif msg.payload == 'exit':
             newgame.shutdown_request = True
         else:
-            logging.error("Unrecognised Payload:" + str(msg))
+            logging.error('Unrecognised Payload: %s', msg)
         return True
 
     
 def on_switch_message(client, newgame, msg):
     msg.payload = str(msg.payload.decode("utf-8"))
-    logging.debug(msg.topic + " " + msg.payload)
+    logging.debug('%s %s', msg.topic, msg.payload)
     if msg.topic == 'switch/interval' or msg.topic == 'switch/hold_off' or msg.topic =='switch/heartbeat':
         return True
 
@@ -93,14 +139,25 @@ def on_twitter_message(client, newgame, msg):
     if msg.topic == f'twitter/{newgame.username}':
         if msg.payload == 'True':
             newgame.twitter_follower = True
-            logging.info(f'{newgame.username} is twitter follower')
+            logging.info('%s is twitter follower', newgame.username)
         elif msg.payload == 'False':
             newgame.twitter_follower = False
-            logging.info(f'{newgame.username} is not twitter follower')
+            logging.info('%s is not twitter follower', newgame.username)
         else:
-            logging.info(f'{msg.topic} unhandled payload {msg.payload}')
+            logging.info('%s unhandled payload %s', msg.topic, msg.payload)
         return True
 
+def board_callback(callback):
+    """
+    Wrap a message callback for the multi-board topics, the callback is passed the game for the
+    board named in the topic and the message with the ``board/<id>/`` prefix removed
+    """
+    def routed_callback(client, boards, msg):
+        routed = boards.route(msg)
+        if routed is not None:
+            callback(client, *routed)
+    return routed_callback
+
 if exists('game/config.yaml'):
     conf_file = 'game/config.yaml'
 elif exists('config.yaml'):
@@ -108,10 +165,11 @@ elif exists('config.yaml'):
 else:
     logging.error("Cannot find config file")
     quit()
-mqttbroker, gamesettings, switchsettings, logconf = readconfigfile(conf_file)
+(mqttbroker, gamesettings, switchsettings, logconf, metricsettings, leaderboardsettings,
+ journalsettings, checkpointsettings) = readconfigfile(conf_file)
 
 #configure logging
-logging.config.dictConfig(logconf)
+queue_logging.configure(logconf)
 
 #Parse command line arguments (e.g. to determine if running in Docker stack)
 
@@ -132,32 +190,112 @@ else:
 client = mqtt.Client(str(uuid.uuid4())+'cornhole_game')
 client.on_connect = on_connect
 client.on_message = on_message
-client.message_callback_add("game/#", on_control_message)
-client.message_callback_add("switch/#", on_switch_message)
-client.message_callback_add("ui/#", on_userdata_message)
-client.message_callback_add("twitter/#", on_twitter_message)                                                                    
-logging.debug("Defining connection to broker")
-client.connect_async(mqttbroker['broker'], mqttbroker['port'], mqttbroker['KeepAlive'])
+board_ids = gamesettings.get('boards') or []
+#Init a game for each board, or a single game on the un-prefixed topics
+if board_ids:
+    boards = Boards(gamesettings, client, board_ids, journalsettings, checkpointsettings)
+    games = list(boards)
+    logging.info('Running %s boards: %s', len(boards), board_ids)
+else:
+    boards = None
+    newgame = Game(gamesettings, client, journal=open_journal(journalsettings),
+                   checkpoint=open_checkpoint(checkpointsettings))
+    games = [newgame]
 
-# configure the switch
-client.publish(f'switch/interval', switchsettings['interval'], retain=True)
-client.publish(f'switch/hold_off', switchsettings['hold_off'], retain=True)
+watcher = ConfigWatcher(conf_file, games, client, interval=float(gamesettings.get('config_poll_interval', 1)))
+if metricsettings.get('enabled', False):
+    from metrics import Metrics
+    metrics = Metrics(games, client)
+else:
+    metrics = None
+count = metrics.counted if metrics is not None else (lambda callback: callback)
+if metrics is not None:
+    metrics.wrap_publish()
+    client.on_message = count(on_message)
 
-#Init a game
-newgame = Game(gamesettings, client)
+if board_ids:
+    client.message_callback_add("board/+/game/#", count(board_callback(on_control_message)))
+    client.message_callback_add("board/+/switch/#", count(board_callback(on_switch_message)))
+    client.message_callback_add("board/+/ui/#", count(board_callback(on_userdata_message)))
+    client.message_callback_add("board/+/twitter/#", count(board_callback(on_twitter_message)))
+else:
+    client.message_callback_add("game/#", count(on_control_message))
+    client.message_callback_add("switch/#", count(on_switch_message))
+    client.message_callback_add("ui/#", count(on_userdata_message))
+    client.message_callback_add("twitter/#", count(on_twitter_message))
 
-#Threaded MQTT handler
-if command_args.inDocker:
-    logging.info("Starting connection, waiting for 5 seconds for broker to spawn")
-    time.sleep(5)
+if leaderboardsettings.get('enabled', False):
+    from leaderboard import LeaderboardStore, LeaderboardService
+    leaderboard = LeaderboardService(LeaderboardStore(leaderboardsettings.get('database', 'leaderboard.db')), client,
+                                     top=int(leaderboardsettings.get('top', 10)))
+    # results are already counted by the game/# callbacks
+    client.message_callback_add("game/leaderboard", leaderboard.on_result)
+    client.message_callback_add("board/+/game/leaderboard", leaderboard.on_result)
+    client.message_callback_add(LeaderboardService.request_topic, count(leaderboard.on_request))
 else:
-    logging.info("Starting connection: Ensure that your MQTT broker is running at " + str(mqttbroker['broker']) + ":" + str(mqttbroker['port']))
+    leaderboard = None
+logging.debug("Defining connection to broker")
+# retry connecting straight away and back off exponentially, rather than waiting a fixed time for
+# the broker to start
+reconnect_delay = float(mqttbroker.get('reconnect_delay', 0.05))
+max_reconnect_delay = float(mqttbroker.get('max_reconnect_delay', 0.5))
+client.reconnect_delay_set(reconnect_delay, max_reconnect_delay)
+client.connect_async(mqttbroker['broker'], mqttbroker['port'], mqttbroker['KeepAlive'])
+logging.info('Starting connection: Ensure that your MQTT broker is running at %s:%s',
+             mqttbroker['broker'], mqttbroker['port'])
 
 print('Starting MQTT listener')
-client.user_data_set(newgame)
+client.user_data_set(boards if boards is not None else newgame)
 print(client)
+game_main = boards.main if boards is not None else newgame.main
+
 
-client.loop_start()
-asyncio.run(newgame.main(), debug=True)
-client.loop_stop()
+async def serve():
+    """
+    Run the games, along with the configuration file watcher and the metrics endpoint when it is
+    enabled
+    """
+    if metrics is not None:
+        await metrics.start(metricsettings.get('port', 9108), metricsettings.get('host', '0.0.0.0'))
+    if leaderboard is not None:
+        # results received before now wait in its queue
+        leaderboard.start(asyncio.get_running_loop())
+    watch_task = asyncio.create_task(watcher.run())
+    games_task = asyncio.ensure_future(game_main())
+    # runs once the games have started their loops
+    asyncio.get_running_loop().call_soon(startup_step, 'running')
+    try:
+        await games_task
+    finally:
+        watch_task.cancel()
+        if metrics is not None:
+            metrics.stop()
+        if leaderboard is not None:
+            leaderboard.stop()
+        for game in games:
+            if game.journal is not None:
+                game.journal.close()
+            if game.checkpoint is not None:
+                game.checkpoint.close()
+
+
+async def asyncio_main():
+    """
+    Run the MQTT client on the game's event loop, so callbacks are handled on the loop thread
+    """
+    helper = AsyncioHelper(asyncio.get_running_loop(), client, reconnect_delay, max_reconnect_delay)
+    helper.start()
+    try:
+        await serve()
+    finally:
+        helper.stop()
+
+
+if mqttbroker.get('transport', 'thread') == 'asyncio':
+    logging.info('Using asyncio MQTT transport')
+    asyncio.run(asyncio_main(), debug=True)
+else:
+    client.loop_start()
+    asyncio.run(serve(), debug=True)
+    client.loop_stop()
 print('Game thread complete')
\ No newline at end of file
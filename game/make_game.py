@@ -10,10 +10,35 @@ from re import S
 import time
 import json
 import asyncio
+import heapq
 import logging
+from collections import deque
 import paho.mqtt.client as mqtt
 from math import floor
 
+from stats import Histogram, LATENCY_BUCKETS_MS, DURATION_BUCKETS_S, SCORE_BUCKETS
+from publisher import CoalescingPublisher
+from journal import GAME_START, GAME_END
+
+
+def _signal(loop, event):
+    """
+    Set an :class:`asyncio.Event` from any thread. The MQTT callbacks run on the paho network
+    thread, so the event is handed over to its own loop with ``call_soon_threadsafe``. Nothing is
+    set once the loop is closed, e.g. for a late callback at shutdown.
+    """
+    if loop is None or event is None or loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        event.set()
+    else:
+        loop.call_soon_threadsafe(event.set)
+
+
 class MakeGame:
     """
     Main Game Class
@@ -21,50 +46,173 @@ class MakeGame:
     Args:
         configdata: data from the configuration file
         mqtt_client: mqtt client instance
+        board: id of the board when several boards share the broker, the game's topics are then
+            prefixed with ``board/<board>/``
+        clock: function returning the current time in seconds since the epoch
+        rng: source of random numbers for the holes, e.g. a seeded :class:`random.Random`
+        journal: :class:`journal.Journal` to record the events of every game in
+        checkpoint: :class:`checkpoint.Checkpoint` to save the game in play to, a game found in it
+            when the game loop starts is resumed
 
     """
-    def __init__(self, configdata, mqtt_client: mqtt.Client):
+    __slots__ = ('configdata', 'mqtt', 'board', 'prefix', 'clock', 'rng', 'journal', 'checkpoint', '_resume',
+                 'holes', 'status_publisher', 'start_latency',
+                 '_loop', '_wakeup', '_command_changed', '_command_time', '_command',
+                 '_shutdown_request', '_username', '_twitter_follower',
+                 'switch_events', 'switch_queue_size', 'switches_queued', 'switches_scored',
+                 'switches_dropped', 'switches_too_old', 'max_switch_age', 'switch_latency', 'game_durations',
+                 'game_scores',
+                 'status', 'state', 'score', 'basic_points',
+                 'bonus_multiplier', 'start_time', 'finish_time', 'rel_time', 'remain_time',
+                 'seconds_remaining', 'hole_lt', 'hole_ut')
+
+    def __init__(self, configdata, mqtt_client: mqtt.Client, board=None, clock=time.time, rng=random,
+                 journal=None, checkpoint=None):
 
-        mqtt_attributes = ["status", "score", "colours", "nHoles", "difficulty", "gametime", "score", "start_time", "finish_time", "rel_time", "user", 'remain_time', 'seconds_remaining']
-        self.score = 0
         self.configdata = configdata
+        self.mqtt:mqtt.Client = mqtt_client
+        self.board = board
+        self.prefix = '' if board is None else f'board/{board}/'
+        self.clock = clock
+        self.rng = rng
+        self.journal = journal
+        self.checkpoint = checkpoint
+        self._resume = None
+        self._loop = None
+        self._wakeup = None
+        self._command_changed = None
+        self._command_time = None
+        self.start_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.status_publisher = CoalescingPublisher(self.mqtt, self.prefix + 'game/status',
+                                                    window=float(configdata.get('status_window', 0.05)))
+        self.switch_events = deque()
+        self.switch_queue_size = int(configdata.get('switch_queue_size', 1024))
+        self.switches_queued = 0
+        self.switches_scored = 0
+        self.switches_dropped = 0
+        self.switches_too_old = 0
+        self.max_switch_age = float(configdata.get('max_switch_age', 2))
+        self.switch_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.game_durations = Histogram(DURATION_BUCKETS_S)
+        self.game_scores = Histogram(SCORE_BUCKETS)
+        self.holes = []
+        self.state = 'standby'
+        self._clear()
+
+        self.publish()
+
+    def _clear(self):
+        """
+        Return the game to its state before a game is played, the holes are reused rather than
+        rebuilt unless the number of holes has changed
+        """
+        self.score = 0
         self.shutdown_request = False
         self.command = 'standby'
         self.status = "off"
         self._twitter_follower = False
-        self.mqtt:mqtt.Client = mqtt_client
-        self.holes = [_GameHole(id=x + 1,
-                                status=False,
-                                mqtt_client=self.mqtt,
-                                holeconfig=self.holeconfig,
-                                colour_list=self.colours) for x in range(self.nHoles)]
-        self.basic_points = [int(x) for x in configdata['hole_scores']]
-        self.bonus_multiplier = int(configdata['bonusMult'])
+        if self._holes_outdated():
+            self._build_holes()
+        else:
+            for hole in self.holes:
+                hole.reset()
+        self.basic_points = [int(x) for x in self.configdata['hole_scores']]
+        self.bonus_multiplier = int(self.configdata['bonusMult'])
         self.start_time = None
         self.finish_time = None
         self.rel_time = None
         self.hole_lt = 1
         self.hole_ut = 5
-        self.shutdown_request = False
-        self.command = 'standby'
         self._username = 'anon'
         self.remain_time = None
         self.seconds_remaining = self.gametime
-        self.score_event = None
+        self.switch_events.clear()
 
-        self.publish()
+    def _holes_outdated(self) -> bool:
+        """
+        Whether the number of holes or their encoding no longer match the settings
+        """
+        encoding = self.configdata.get('hole_encoding', 'json')
+        return len(self.holes) != self.nHoles or any(hole.encoding != encoding for hole in self.holes)
+
+    def _build_holes(self):
+        self.holes = [_GameHole(id=x + 1,
+                                status=False,
+                                mqtt_client=self.mqtt,
+                                holeconfig=self.holeconfig,
+                                colour_list=self.colours,
+                                prefix=self.prefix,
+                                rng=self.rng,
+                                clock=self.clock,
+                                encoding=self.configdata.get('hole_encoding', 'json'),
+                                journal=self.journal) for x in range(self.nHoles)]
+
+    def reconfigure(self, configdata) -> set[str]:
+        """
+        Apply new settings to the game in place, the game can be running. Hole timings, colours,
+        scores and the switch and status settings take effect straight away, a change to the number
+        of holes or their encoding, and the scores with it, once no game is being played, and the game
+        time from the next game.
+        When the hole timelines are precomputed (``hole_schedule``), a change to the hole settings or
+        colours during a game draws the rest of the game's timelines afresh, with a new seed, and
+        publishes them on ``game/schedule``.
+
+        Args:
+            configdata: the new ``gamesettings`` section of the configuration file
+
+        :return: names of the settings that changed
+        """
+        changed = {key for key in configdata.keys() | self.configdata.keys()
+                   if configdata.get(key) != self.configdata.get(key)}
+        if not changed:
+            return changed
+        self.configdata = configdata
+        for hole in self.holes:
+            hole.holeconfig = self.holeconfig
+            hole.colour_list = self.colours
+        playing = self.status in ('starting', 'playing')
+        # the scores follow the holes, which are only rebuilt once no game is being played
+        if not (playing and self._holes_outdated()):
+            self.basic_points = [int(x) for x in self.configdata['hole_scores']]
+        self.bonus_multiplier = int(self.configdata['bonusMult'])
+        self.status_publisher.window = float(configdata.get('status_window', 0.05))
+        self.switch_queue_size = int(configdata.get('switch_queue_size', 1024))
+        self.max_switch_age = float(configdata.get('max_switch_age', 2))
+        if self.status == 'playing' and changed & {'holeconfig', 'colours', 'hole_schedule'}:
+            if configdata.get('hole_schedule', False):
+                # each hole finishes the state it is in, then follows the new timeline
+                self.schedule_holes()
+            else:
+                for hole in self.holes:
+                    hole.schedule = None
+        if not playing:
+            if self._holes_outdated():
+                for hole in self.holes:
+                    hole.off()
+                self._build_holes()
+            self.seconds_remaining = self.gametime
+            self.publish()
+        return changed
 
     def update_time(self):
         oldtime = self.seconds_remaining
-        self.remain_time = max(self.finish_time - time.time(),0)
-        self.seconds_remaining = max(floor(self.finish_time - time.time()),0)
+        now = self.clock()
+        self.remain_time = max(self.finish_time - now,0)
+        self.seconds_remaining = max(floor(self.finish_time - now),0)
         if self.seconds_remaining == oldtime:
             return False
         else:
             return True
     
        
+    def _bind_loop(self):
+        self._loop = asyncio.get_running_loop()
+        self.status_publisher.loop = self._loop
+
     async def main(self):
+        self._bind_loop()
+        self._command_changed = asyncio.Event()
+        self.resume()
         while True:
             if self.command == 'standby':
                 await self.standby()
@@ -72,64 +220,225 @@ class MakeGame:
                 await self.startgame()
     
     def reset(self):
-        self.__init__(self.configdata, self.mqtt)
+        if self.journal is not None:
+            self.journal.command(self.clock(), 'reset')
+        self._clear()
         self.status = "reset"
         self.publish()
         
+    def resume(self):
+        """
+        Pick up the game in the checkpoint, if there is one, after the game service restarted. A
+        game with time left is played on from where it was, one that ran out of time while the
+        service was down is ended and its score posted.
+        """
+        state = self.checkpoint.load() if self.checkpoint is not None else None
+        if not state or state.get('status') != 'playing':
+            return
+        self.score = state['score']
+        self.start_time = state['start_time']
+        self.finish_time = state['finish_time']
+        self._username = state['username']
+        self._twitter_follower = state['twitter_follower']
+        for hole, (status, colour) in zip(self.holes, state['holes']):
+            hole.status = status
+            hole.colour = colour
+        if self.finish_time > self.clock():
+            logging.info('Resuming the game of %s with %.1f s left', self._username, self.finish_time - self.clock())
+            self._resume = state
+            self.command = 'run'
+            self._command_time = None
+        else:
+            logging.info('The game of %s ended while the game service was down', self._username)
+            self._finish()
+
+    def _save_checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.save({'status': self.status,
+                                  'score': self.score,
+                                  'start_time': self.start_time,
+                                  'finish_time': self.finish_time,
+                                  'username': self._username,
+                                  'twitter_follower': self._twitter_follower,
+                                  'holes': [(hole.status, hole.colour) for hole in self.holes],
+                                  'saved': self.clock()})
+
+    def republish(self):
+        """
+        Publish the game status and every hole again, e.g. when the connection to the broker is
+        (re)established, safe to call from the MQTT network thread
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is not None and running is not self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.republish)
+            return
+        for hole in self.holes:
+            hole.republish()
+        self.publish(force=True)
+
     async def startgame(self):
-        self.start_time = time.time()
-        self.finish_time = time.time() + self.gametime
-        self.rel_time = time.time() - self.start_time
-        logging.info(f'{self.start_time=:.1f}, {self.finish_time=:.1f}')
+        resume, self._resume = self._resume, None
+        if resume is None:
+            self.start_time = self.clock()
+            self.finish_time = self.clock() + self.gametime
+        self.rel_time = self.clock() - self.start_time
+        logging.info('self.start_time=%.1f, self.finish_time=%.1f', self.start_time, self.finish_time)
         self.update_time()
-        self.status = "starting"
-        self.publish()
-        for hole in self.holes: #Turn all holes off at start of game
-            hole.off()
+        if resume is None:
+            if self.journal is not None:
+                self.journal.record(self.start_time, GAME_START, self.finish_time, self._username)
+            self.status = "starting"
+            self.publish()
+            if self._command_time is not None:
+                self.start_latency.observe((time.perf_counter() - self._command_time) * 1000)
+                self._command_time = None
+            for hole in self.holes: #Turn all holes off at start of game
+                hole.off()
+            if self.configdata.get('hole_schedule', False):
+                self.schedule_holes()
         self.status = "playing"
-        self.publish()
+        if resume is None:
+            self.publish()
+        else:
+            self.republish()
+        self._save_checkpoint()
         await self.holeroutine()
+        self._finish()
+        return 'game end'
+
+    def _finish(self):
+        """
+        End the game, post the score and get ready for the next one
+        """
         for hole in self.holes:
             hole.off()
+        self.game_durations.observe(self.clock() - self.start_time)
+        self.game_scores.observe(self.score)
+        if self.journal is not None:
+            self.journal.record(self.clock(), GAME_END, self.score, self._twitter_follower,
+                                self._username)
         self.scoreboard()
         self.status = "end"
-        self.publish()
+        self.publish(flush=True)
+        self.publish_stats()
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
         self.command = 'standby'
         self.reset()
-        return 'game end'
     
     async def holeroutine(self):
+        self._bind_loop()
+        self._wakeup = asyncio.Event()
+        if self.shutdown_request or self.switch_events:
+            self._wakeup.set()
         for hole in self.holes:
             hole.running = True
-        holetasks = [hole.set() for hole in self.holes]
-        asynctasks = asyncio.gather(*holetasks)
+        scheduler = _HoleScheduler(self.holes)
+        holetask = asyncio.create_task(scheduler.run())
         shutdown = False
         while not shutdown:
-            try:
-                if self.update_time():
-                    self.publish()
-                shutdown = await asyncio.wait_for(self.game_interrupt(), timeout=self.remain_time)
-                #shutdown = await asyncio.wait_for(self.game_interrupt(), timeout=3)
-            except asyncio.TimeoutError:
+            if self.update_time():
+                self.publish()
+                self._save_checkpoint()
+            if self.remain_time <= 0:
                 logging.info('Game ran to completion')
-                shutdown = True
                 break
+            # sleep until the next whole second (to publish the countdown) unless woken
+            # (at least a millisecond, so the clock is sure to have moved on when it wakes)
+            tick = max(min(self.remain_time - self.seconds_remaining, self.remain_time), 0.001)
+            try:
+                shutdown = await asyncio.wait_for(self.game_interrupt(), timeout=tick)
+            except asyncio.TimeoutError:
+                pass
         for hole in self.holes:
                 hole.running = False
-        asynctasks.cancel()
+        holetask.cancel()
+        # let the scheduler finish before the game moves on
+        await asyncio.gather(holetask, return_exceptions=True)
+
+    def schedule_holes(self, seed: int = None):
+        """
+        Precompute the timeline of every hole for the game and publish it, retained, on
+        ``game/schedule`` so that a game can be replayed from its seed. Called again if the hole
+        settings change during the game, the timelines then start from the holes' next changes.
+
+        A hit moves its hole on to the next cycle early, which puts the rest of that hole's timeline
+        on ``game/schedule`` out of step, so each time a hole is hit its remaining timeline is
+        published, retained, on ``game/schedule/<id>``::
+
+            {"time": <when the current cycle began>, "cycles": [[status, colour, duration], ...]}
+
+        starting with the cycle the hole is now in.
+
+        Args:
+            seed: seed for the timelines, a new one is drawn if not given
+        """
+        # numpy is only imported when a schedule is used, it takes longer to import than the rest
+        # of the game service together
+        from hole_schedule import generate as generate_schedule
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        timelines = generate_schedule(seed, self.holeconfig, self.colours, self.nHoles, self.gametime)
+        for hole, timeline in zip(self.holes, timelines):
+            hole.schedule = timeline
+        self.mqtt.publish(self.prefix + 'game/schedule', json.dumps({
+            'seed': seed,
+            'holes': {hole.id: hole.schedule.upcoming() for hole in self.holes}
+        }), retain=True)
+        for hole in self.holes:
+            # clear the timelines republished after hits in an earlier game
+            if hole.rescheduled:
+                self.mqtt.publish(hole.schedule_topic, None, retain=True)
+                hole.rescheduled = False
 
     def switchevent(self, msg):
+        """
+        Queue a hit from a switch for scoring, safe to call from the MQTT network thread. Hits
+        arriving when the queue is full are dropped and counted.
+
+        The payload is ``{"colour": <colour of the hole or off>}``, optionally with ``"time"``, the
+        time of the hit in seconds since the epoch. A timed hit is scored against the state the
+        hole was in at that time, rather than when the hit is processed, and is not scored at all if
+        that is before the oldest state kept in the hole's history.
+        """
         logging.debug('Switch Event')
-        self.bonusFlag = False
+        received = self.clock()
         switchdata = json.loads(msg.payload)
-        switchdata['id'] = int(msg.topic[-1]) - 1
-        if switchdata['colour'] != 'off':
-            self.holes[switchdata['id']].interruptFlag = True
-            self.bonusFlag = True
-        self.score_event = switchdata['id']
+        switchdata['id'] = int(msg.topic.rsplit('/', 1)[-1]) - 1
+        if not 0 <= switchdata['id'] < len(self.holes):
+            self.switches_dropped += 1
+            logging.warning('Hit on hole %s dropped, the game has %s holes', switchdata['id'] + 1, len(self.holes))
+            return
+        bonus = switchdata['colour'] != 'off'
+        hit_time = switchdata.get('time')
+        if hit_time is not None:
+            # trust the switch's clock only as far back as the hole history goes
+            hit_time = min(max(float(hit_time), received - self.max_switch_age), received)
+        if self.journal is not None:
+            self.journal.switch(received, switchdata['id'] + 1, bonus, hit_time)
+        if bonus:
+            self.holes[switchdata['id']].interrupt()
+        if len(self.switch_events) >= self.switch_queue_size:
+            self.switches_dropped += 1
+            logging.warning('Switch event queue full, hit on hole %s dropped', switchdata['id'] + 1)
+            return
+        # deque appends and pops are atomic, so the queue needs no lock between the threads
+        self.switch_events.append((switchdata['id'], bonus, hit_time, received))
+        self.switches_queued += 1
+        _signal(self._loop, self._wakeup)
     
-    def publish(self):
+    def publish(self, flush=False, force=False):
+        """
+        Publish the game status on ``game/status``, updates are coalesced over the configured
+        ``status_window``
 
+        Args:
+            flush: send the status now rather than at the end of the window
+            force: send the status now even if it has not changed since it was last sent
+        """
         status_dict = {'status': self.status,
                        'raw_score': self.score,  # the raw score is the point accumulated with
                                                  # hits on holes, the score includes any
@@ -147,20 +456,38 @@ class MakeGame:
         else:
             status_dict['score'] = self.score
 
-        payload = json.dumps(status_dict)
-
-        self.mqtt.publish('game/status', payload)
+        self.status_publisher.update(status_dict, flush=flush, force=force)
     
     def scoreboard(self):
-        self.mqtt.publish('game/leaderboard', payload=json.dumps({
+        self.mqtt.publish(self.prefix + 'game/leaderboard', payload=json.dumps({
             'user': self._username,
             'score': self.score,
             'twitter_follower': self._twitter_follower
-        }))
+        }), qos=1)  # queued by the client until it is connected, so a result is not lost
         
+    def stats(self) -> dict:
+        """
+        Statistics on the running game service
+        """
+        return {'start_latency_ms': self.start_latency.as_dict(),
+                'switch_to_score_ms': self.switch_latency.as_dict(),
+                'game_duration_s': self.game_durations.as_dict(),
+                'game_score': self.game_scores.as_dict(),
+                'status_messages': self.status_publisher.stats(),
+                'switch_events': {'queued': self.switches_queued,
+                                  'scored': self.switches_scored,
+                                  'dropped': self.switches_dropped,
+                                  'too_old': self.switches_too_old},
+                'hole_messages': {'published': sum(hole.published for hole in self.holes),
+                                  'suppressed': sum(hole.suppressed for hole in self.holes)}}
+
+    def publish_stats(self):
+        self.mqtt.publish(self.prefix + 'game/stats', json.dumps(self.stats()), retain=True)
+
     async def standby(self):
         self.state = 'standby'
-        time.sleep(1)
+        await self._command_changed.wait()
+        self._command_changed.clear()
         return self.state
     
     def quit(self):
@@ -168,13 +495,6 @@ class MakeGame:
         self.publish()
         return self.state
     
-    async def game_interrupt(self):
-        while not (self.shutdown_request):
-            await asyncio.sleep(0)
-        logging.debug('Game was terminated prematurely')
-
-
-
     @property
     def difficulty(self) -> int:
         """
@@ -225,6 +545,8 @@ class MakeGame:
     @username.setter
     def username(self, value: str):
         self._username = value
+        if self.status == 'playing':
+            self._save_checkpoint()
 
     @property
     def twitter_follower(self) -> bool:
@@ -233,80 +555,187 @@ class MakeGame:
     @twitter_follower.setter
     def twitter_follower(self, value:bool):
         self._twitter_follower = value
-        
-    async def game_interrupt(self):       
+        if self.status == 'playing':
+            self._save_checkpoint()
+
+    @property
+    def command(self) -> str:
+        """
+        Command for the game loop, 'standby' or 'run', setting it wakes the loop in standby
+        """
+        return self._command
+
+    @command.setter
+    def command(self, value: str):
+        self._command = value
+        if value == 'run':
+            self._command_time = time.perf_counter()
+            if self.journal is not None:
+                self.journal.command(self.clock(), value)
+        _signal(self._loop, self._command_changed)
+
+    @property
+    def shutdown_request(self) -> bool:
+        """
+        Set to end the running game early, wakes the game loop when set from an MQTT callback
+        """
+        return self._shutdown_request
+
+    @shutdown_request.setter
+    def shutdown_request(self, value: bool):
+        self._shutdown_request = value
+        if value:
+            if self.journal is not None:
+                self.journal.command(self.clock(), 'exit')
+            _signal(self._loop, self._wakeup)
+
+    async def game_interrupt(self):
+        """
+        Wait for a switch event or shutdown request and handle it
+
+        :return: True if the game should end
+        """
+        await self._wakeup.wait()
+        self._wakeup.clear()
         if self.shutdown_request:
             logging.debug('Game was terminated prematurely')
             return True
-        elif self.score_event != None:
-            self.score += (self.basic_points[self.score_event] * (self.bonus_multiplier * self.bonusFlag))
+        elif self.switch_events:
+            now = self.clock()
+            while self.switch_events:
+                hole_id, bonus, hit_time, received = self.switch_events.popleft()
+                if hit_time is not None:
+                    state = self.holes[hole_id].state_at(hit_time)
+                    if state is None:
+                        self.switches_too_old += 1
+                        logging.warning('Hit on hole %s at %s is older than the hole history, not scored',
+                                        hole_id + 1, hit_time)
+                        continue
+                    bonus = state[0]
+                points = self.basic_points[hole_id] * (self.bonus_multiplier * bonus)
+                self.score += points
+                if self.journal is not None:
+                    self.journal.score(now, hole_id + 1, points, self.score)
+                self.switches_scored += 1
+                self.switch_latency.observe((now - (received if hit_time is None else hit_time)) * 1000)
             self.publish()
-            self.score_event = None
-            self.bonusFlag = False
-            return False
-        elif self.remain_time <= 0:
-            return True
+            self._save_checkpoint()
+        return False
                
                 
 class _GameHole:
 
     """
     Hole
+
+    The hole state is published on ``holes/<id>`` only when the status or colour changes, in one of
+    two encodings:
+
+    * ``json``: ``{"status": true, "id": 1, "colour": "red"}``
+    * ``compact``: the colour name when the hole is lit, otherwise ``off``
     """
-    mqtt_attributes = ["status", "offtime", "id", "colour" ]
+    mqtt_attributes = ["status", "id", "colour" ]
+    encodings = ('json', 'compact')
+
+    __slots__ = ('id', 'topic', 'encoding', 'mqtt', 'holeconfig', 'colour_list', 'rng', 'schedule', '_payloads',
+                 '_published_state', 'published', 'suppressed', 'status', 'colour', 'running',
+                 'offtime', 'abs_offtime', 'scheduler', 'interruptFlag', 'overrideFlag', 'clock',
+                 'history', 'journal', 'schedule_topic', 'rescheduled')
+
+    #: number of state changes kept to score hits against the state at the time of the hit
+    history_size = 16
     
     def __init__(self, id, status:bool, mqtt_client: mqtt.Client, holeconfig: dict,
-                 colour_list: list[str]):
+                 colour_list: list[str], prefix: str = '', rng=random, clock=time.time,
+                 encoding: str = 'json', journal=None):
 
+        if encoding not in self.encodings:
+            raise ValueError(f'hole encoding should be one of {self.encodings}, got {encoding}')
         self.id:int = id
+        self.topic = prefix + 'holes/' + str(id)
+        self.schedule_topic = prefix + 'game/schedule/' + str(id)
+        self.rescheduled = False
+        self.encoding = encoding
+        self.mqtt:mqtt.Client = mqtt_client
+        self.holeconfig = holeconfig
+        self.colour_list = colour_list
+        self.rng = rng
+        self.clock = clock
+        self.journal = journal
+        self.history = deque(maxlen=self.history_size)
+        self._payloads = {}
+        self._published_state = None
+        self.published = 0
+        self.suppressed = 0
+        self.scheduler = None
+
+        self.reset(status)
+
+    def reset(self, status: bool = False):
+        """
+        Return the hole to its state before a game is played
+        """
         self.status:bool = status
         self.running = False
         self.offtime = 0
         self.abs_offtime = 0
-        self.mqtt:mqtt.Client = mqtt_client
-        self.colour = colour_list[0]
-        self.holeconfig = holeconfig
-        self.colour_list = colour_list
-
-        self.taskname = None
-
-        self.publish()
+        self.colour = self.colour_list[0]
         self.interruptFlag = False
         self.overrideFlag = False
+        self.schedule = None
+        self.history.clear()
 
+        self.publish()
  
-    # async def main(self):
-    #     await self.set()
-             
-    async def set(self, sleepTime=1):
-        while self.running:
-            self.taskname = asyncio.current_task()
-            if random.random() <= self.probOn: 
-                self.status = True
-                self.colour = random.choice(self.colour_list)  
-                if not self.overrideFlag:
-                    sleepTime = random.uniform(*self.onRange)
-            else:
-                self.status = False
-                if not self.overrideFlag:
-                    sleepTime = random.uniform(*self.offRange)
-            self.offtime = sleepTime
-            self.overrideFlag = False
-            self.interruptFlag = False
-            await self.asyncpublish()
-            try:
-                await asyncio.wait_for(self.hole_interrupt(), timeout=sleepTime)
-            except asyncio.TimeoutError:
-                logging.debug('Hole ' + str(self.id) + ' was not interrupted')
-            except asyncio.CancelledError:
-                logging.debug('Hole task ' + str(self.id) + ' was cancelled')
+    def step(self) -> float:
+        """
+        Choose and publish the next state of the hole, called by the scheduler when the previous
+        state has run its time or the hole has been hit
+
+        :return: seconds until the next change
+        """
+        sleepTime = self.offtime
+        if self.schedule is not None:
+            status, colour, duration = self.schedule.next()
+            self.status = status
+            if status:
+                self.colour = colour
+            if not self.overrideFlag:
+                sleepTime = duration
+        elif self.rng.random() <= self.probOn: 
+            self.status = True
+            self.colour = self.rng.choice(self.colour_list)  
+            if not self.overrideFlag:
+                sleepTime = self.rng.uniform(*self.onRange)
+        else:
+            self.status = False
+            if not self.overrideFlag:
+                sleepTime = self.rng.uniform(*self.offRange)
+        self.offtime = sleepTime
+        if self.schedule is not None and self.interruptFlag:
+            self.publish_schedule()
+        self.overrideFlag = False
+        self.interruptFlag = False
+        self.publish()
+        return sleepTime
           
-    async def hole_interrupt(self):     
-        while not (self.interruptFlag):
-            #logging.debug(str(self.id) + ' interrupt loop')
-            await asyncio.sleep(0)     
-        logging.debug('Hole ' + str(self.id) + ' was interrupted')
-        self.overrideFlag = True
+    def interrupt(self):
+        """
+        Flag a hit on this hole, safe to call from the MQTT network thread
+        """
+        self.interruptFlag = True
+        if self.scheduler is not None:
+            self.scheduler.wake(self)
+
+    def publish_schedule(self):
+        """
+        Publish the rest of the hole's timeline from the cycle it is in, after a hit has moved it on
+        """
+        cycles = self.schedule.upcoming(self.schedule.position - 1)
+        # after a hit the new cycle lasts the full duration of the interrupted one, not its own
+        cycles[0][2] = round(self.offtime, 3)
+        self.mqtt.publish(self.schedule_topic, json.dumps({'time': self.clock(), 'cycles': cycles}), retain=True)
+        self.rescheduled = True
 
     def off(self):
         self.status = False
@@ -317,10 +746,55 @@ class _GameHole:
         self.publish()
     
     def publish(self):
-        self.mqtt.publish('holes/' + str(self.id), json.dumps({k:self.__dict__[k] for k in self.mqtt_attributes}))
+        state = (self.status, self.colour)
+        if state == self._published_state:
+            self.suppressed += 1
+            return
+        now = self.clock()
+        self.history.append((now, self.status, self.colour))
+        if self.journal is not None:
+            self.journal.hole(now, self.id, self.status, self.colour)
+        payload = self._payloads.get(state)
+        if payload is None:
+            payload = self._payloads[state] = self.encode()
+        self._published_state = state
+        self.mqtt.publish(self.topic, payload)
+        self.published += 1
         
     async def asyncpublish(self):
-        self.mqtt.publish('holes/' + str(self.id), json.dumps({k:self.__dict__[k] for k in self.mqtt_attributes}))
+        self.publish()
+
+    def republish(self):
+        """
+        Publish the hole state even if it has not changed
+        """
+        self._published_state = None
+        self.publish()
+
+    def state_at(self, when: float):
+        """
+        The status and colour the hole was showing at a time, from the recent history of the hole
+
+        Args:
+            when: time in seconds since the epoch
+
+        :return: ``(status, colour)``, or None if the time is before the oldest change kept, when
+            the state is not known
+        """
+        for changed, status, colour in reversed(self.history):
+            if changed <= when:
+                return status, colour
+        if self.history:
+            return None
+        return self.status, self.colour
+
+    def encode(self) -> str:
+        """
+        Payload for the current hole state in the configured encoding
+        """
+        if self.encoding == 'compact':
+            return self.colour if self.status else 'off'
+        return json.dumps({k: getattr(self, k) for k in self.mqtt_attributes})
 
     @property
     def onRange(self) -> tuple[int, int]:
@@ -341,4 +815,69 @@ class _GameHole:
         """
         probability the hole is illuminated 0 to 1
         """
-        return self.holeconfig['prob_on']
\ No newline at end of file
+        return self.holeconfig['prob_on']
+
+
+class _HoleScheduler:
+    """
+    Drives every hole of a game from a single task. The time of each hole's next change is kept
+    in a heap and the task sleeps until the earliest one, a hit on a hole wakes it early to move
+    that hole on straight away.
+
+    Args:
+        holes: holes to drive
+    """
+    __slots__ = ('holes', 'heap', 'due', 'interrupted', 'loop', 'wakeup')
+
+    def __init__(self, holes: list):
+        self.holes = holes
+        self.heap = []
+        self.due = {}
+        self.interrupted = deque()
+        self.loop = None
+        self.wakeup = None
+
+    def wake(self, hole: _GameHole):
+        """
+        Move a hole on early, safe to call from the MQTT network thread
+        """
+        self.interrupted.append(hole)
+        _signal(self.loop, self.wakeup)
+
+    def _step(self, hole: _GameHole, now: float):
+        due = now + hole.step()
+        self.due[hole.id] = due
+        heapq.heappush(self.heap, (due, hole.id, hole))
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        for hole in self.holes:
+            hole.scheduler = self
+        try:
+            now = self.loop.time()
+            for hole in self.holes:
+                self._step(hole, now)
+            while True:
+                now = self.loop.time()
+                while self.interrupted:
+                    hole = self.interrupted.popleft()
+                    if hole.running:
+                        logging.debug('Hole %s was interrupted', hole.id)
+                        hole.overrideFlag = True
+                        self._step(hole, now)
+                while self.heap and self.heap[0][0] <= now:
+                    due, hole_id, hole = heapq.heappop(self.heap)
+                    # entries left behind when a hole was moved on early are skipped
+                    if due == self.due[hole_id] and hole.running:
+                        self._step(hole, now)
+                if self.interrupted:
+                    continue
+                timer = self.loop.call_at(self.heap[0][0], self.wakeup.set) if self.heap else None
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                if timer is not None:
+                    timer.cancel()
+        finally:
+            for hole in self.holes:
+                hole.scheduler = None
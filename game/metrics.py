@@ -0,0 +1,242 @@
+"""
+Prometheus style metrics for the game service, served as plain text on ``http://<host>:<port>/metrics``
+
+The endpoint is a minimal HTTP server on the game's event loop so no extra packages or services
+are needed, point a Prometheus scrape job at it or simply ``curl`` it.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+from stats import Histogram, LATENCY_BUCKETS_MS
+
+#: seconds between event loop lag samples
+LAG_INTERVAL = 0.5
+
+#: topic roots whose second level names a switch, hole or player, counted as one series
+PER_ITEM_ROOTS = ('switch', 'holes', 'twitter', 'ui')
+#: topic roots whose second level is one of a fixed set of names
+FIXED_ROOTS = ('game', 'leaderboard', 'detector')
+
+
+@functools.lru_cache(maxsize=1024)
+def topic_pattern(topic: str) -> str:
+    """
+    The pattern a topic is counted under, so the number of series stays fixed however many
+    players and switches there are, e.g. ``board/2/twitter/dave`` is counted as ``board/+/twitter/+``
+    """
+    levels = topic.split('/')
+    prefix = ''
+    if levels[0] == 'board' and len(levels) > 2:
+        prefix, levels = 'board/+/', levels[2:]
+    if levels[0] in PER_ITEM_ROOTS:
+        kept = 1
+    elif levels[0] in FIXED_ROOTS:
+        kept = 2
+    else:
+        return prefix + 'other'
+    rest = len(levels) - kept
+    return prefix + '/'.join(levels[:kept] + (['+'] if rest == 1 else ['#'] if rest > 1 else []))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    body = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items() if value is not None)
+    return f'{{{body}}}' if body else ''
+
+
+def _histogram(lines: list, name: str, histogram: Histogram, **labels):
+    for bound, count in histogram.as_dict()['buckets'].items():
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+    lines.append(f'{name}_sum{_labels(**labels)} {histogram.total}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+
+class Metrics:
+    """
+    Collects service level metrics and serves them alongside the per game statistics
+
+    Args:
+        games: the games run by this process
+        mqtt_client: mqtt client instance, its publishes are counted once :meth:`wrap_publish` is called
+
+    Messages are counted by :func:`topic_pattern` rather than by topic.
+    """
+    def __init__(self, games, mqtt_client: mqtt.Client):
+        self.games = list(games)
+        self.mqtt: mqtt.Client = mqtt_client
+        self.messages_in = Counter()
+        self.messages_out = Counter()
+        self.loop_lag = Histogram(LATENCY_BUCKETS_MS)
+        self.last_loop_lag = 0.0
+        self.server = None
+        self._lock = threading.Lock()
+        #: qos of each message published and not yet sent, or acknowledged for qos 1 and 2
+        self._pending = {}
+        #: messages reported sent before their publish call returned
+        self._sent_early = set()
+        self._lag_task = None
+
+    def counted(self, callback):
+        """
+        Wrap a message callback so every message it is passed is counted by topic
+        """
+        def counted_callback(client, userdata, msg):
+            with self._lock:
+                self.messages_in[topic_pattern(msg.topic)] += 1
+            return callback(client, userdata, msg)
+        return counted_callback
+
+    def wrap_publish(self):
+        """
+        Count the messages published through the client, and those not yet sent, this sets the
+        client's ``on_publish`` and wraps its ``on_disconnect``
+        """
+        publish = self.mqtt.publish
+        on_disconnect = self.mqtt.on_disconnect
+
+        def counted_publish(topic, payload=None, qos=0, *args, **kwargs):
+            info = publish(topic, payload, qos, *args, **kwargs)
+            with self._lock:
+                self.messages_out[topic_pattern(topic)] += 1
+                # qos 0 messages published while disconnected are dropped when the client reconnects
+                if info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+                    if info.mid in self._sent_early:
+                        self._sent_early.discard(info.mid)
+                    else:
+                        self._pending[info.mid] = qos
+            return info
+
+        def on_publish(client, userdata, mid):
+            with self._lock:
+                if self._pending.pop(mid, None) is None:
+                    self._sent_early.add(mid)
+
+        def counted_on_disconnect(client, userdata, rc):
+            with self._lock:
+                self._pending = {mid: qos for mid, qos in self._pending.items() if qos > 0}
+                self._sent_early.clear()
+            if on_disconnect is not None:
+                on_disconnect(client, userdata, rc)
+
+        self.mqtt.publish = counted_publish
+        self.mqtt.on_publish = on_publish
+        self.mqtt.on_disconnect = counted_on_disconnect
+
+    def publish_queue_depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    async def monitor_loop(self):
+        """
+        Measure how late the event loop wakes a task compared to when it asked to be woken
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.last_loop_lag = max(loop.time() - due, 0.0)
+            self.loop_lag.observe(self.last_loop_lag * 1000)
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            messages_in = sorted(self.messages_in.items())
+            messages_out = sorted(self.messages_out.items())
+
+        lines.append('# HELP cornhole_event_loop_lag_seconds Delay of the last event loop wakeup')
+        lines.append('# TYPE cornhole_event_loop_lag_seconds gauge')
+        lines.append(f'cornhole_event_loop_lag_seconds {self.last_loop_lag}')
+        lines.append('# HELP cornhole_event_loop_lag_ms Delay of event loop wakeups')
+        lines.append('# TYPE cornhole_event_loop_lag_ms histogram')
+        _histogram(lines, 'cornhole_event_loop_lag_ms', self.loop_lag)
+
+        lines.append('# HELP cornhole_mqtt_messages_received_total MQTT messages received by topic pattern')
+        lines.append('# TYPE cornhole_mqtt_messages_received_total counter')
+        for topic, count in messages_in:
+            lines.append(f'cornhole_mqtt_messages_received_total{_labels(topic=topic)} {count}')
+        lines.append('# HELP cornhole_mqtt_messages_published_total MQTT messages published by topic pattern')
+        lines.append('# TYPE cornhole_mqtt_messages_published_total counter')
+        for topic, count in messages_out:
+            lines.append(f'cornhole_mqtt_messages_published_total{_labels(topic=topic)} {count}')
+        lines.append('# HELP cornhole_mqtt_publish_queue_depth Messages published and not yet sent to the broker, '
+                     'or not yet acknowledged for qos 1')
+        lines.append('# TYPE cornhole_mqtt_publish_queue_depth gauge')
+        lines.append(f'cornhole_mqtt_publish_queue_depth {self.publish_queue_depth()}')
+
+        families = (
+            ('cornhole_switch_queue_depth', 'gauge', 'Switch hits waiting to be scored',
+             lambda game: len(game.switch_events)),
+            ('cornhole_switch_events_total', 'counter', 'Switch hits by outcome', None),
+            ('cornhole_games_total', 'counter', 'Games completed', lambda game: game.game_durations.count),
+            ('cornhole_game_score', 'gauge', 'Score of the game in play', lambda game: game.score),
+        )
+        for name, kind, description, value in families:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for game in self.games:
+                if value is not None:
+                    lines.append(f'{name}{_labels(board=game.board)} {value(game)}')
+                    continue
+                for outcome, count in (('queued', game.switches_queued), ('scored', game.switches_scored),
+                                       ('dropped', game.switches_dropped), ('too_old', game.switches_too_old)):
+                    lines.append(f'{name}{_labels(board=game.board, outcome=outcome)} {count}')
+
+        histograms = (
+            ('cornhole_switch_to_score_ms', 'Time from a switch hit to the score being updated',
+             lambda game: game.switch_latency),
+            ('cornhole_start_latency_ms', 'Time from a newgame command to the game starting',
+             lambda game: game.start_latency),
+            ('cornhole_game_duration_seconds', 'Length of completed games', lambda game: game.game_durations),
+            ('cornhole_game_final_score', 'Final score of completed games', lambda game: game.game_scores),
+        )
+        for name, description, histogram in histograms:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for game in self.games:
+                _histogram(lines, name, histogram(game), board=game.board)
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(f'HTTP/1.1 {status}\r\n'
+                         f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logging.debug('Metrics request failed: %s', e)
+        finally:
+            writer.close()
+
+    async def start(self, port: int = 9108, host: str = '0.0.0.0'):
+        """
+        Start serving the metrics and sampling the event loop lag, on the running loop
+        """
+        self._lag_task = asyncio.get_running_loop().create_task(self.monitor_loop())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        logging.info('Serving metrics on http://%s:%s/metrics', host, port)
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self.server is not None:
+            self.server.close()
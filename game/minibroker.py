@@ -0,0 +1,161 @@
+"""
+A minimal in-process MQTT 3.1.1 broker, for benchmarks and checks that need a broker without
+mosquitto. It handles connect, subscribe with ``+`` and ``#`` wildcards, publish at QoS 0 and 1,
+retained messages, ping and disconnect, and delivers every message at QoS 0. It does not do
+authentication, QoS 2, wills or persistent sessions.
+
+    broker = MiniBroker()
+    port = broker.start()
+    ...
+    broker.stop()
+"""
+import asyncio
+import struct
+import threading
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels, levels = topic_filter.split('/'), topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(levels) or (level != '+' and level != levels[index]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+def _length(n: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        encoded.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(encoded)
+
+
+def _publish_packet(topic: str, payload: bytes, retain: bool = False) -> bytes:
+    name = topic.encode('utf-8')
+    body = struct.pack('!H', len(name)) + name + payload
+    return bytes([0x30 | retain]) + _length(len(body)) + body
+
+
+class MiniBroker:
+    """
+    The broker, run on an event loop of its own in a background thread
+
+    Args:
+        host: address to listen on
+        port: port to listen on, 0 for any free port
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.published = 0
+        self.connections = 0
+        self._subscriptions = {}
+        self._retained = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self) -> int:
+        """
+        Start listening
+
+        :return: the port the broker is listening on
+        """
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+        self._thread = threading.Thread(target=run, name='minibroker', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def drop_clients(self):
+        """
+        Close the connection of every client, as if the broker had restarted
+        """
+        def drop():
+            for writer in list(self._subscriptions):
+                writer.transport.abort()
+        self._loop.call_soon_threadsafe(drop)
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            for writer in list(self._subscriptions):
+                writer.transport.abort()
+            # the handlers end once their connections are closed
+            await asyncio.gather(*(asyncio.all_tasks() - {asyncio.current_task()}), return_exceptions=True)
+            self._loop.stop()
+        asyncio.run_coroutine_threadsafe(close(), self._loop)
+        self._thread.join()
+        self._loop.close()
+
+    def _deliver(self, topic: str, payload: bytes):
+        packet = _publish_packet(topic, payload)
+        for writer, filters in list(self._subscriptions.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                writer.write(packet)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._subscriptions[writer] = []
+        self.connections += 1
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 127) * multiplier
+                    multiplier *= 128
+                    if not byte & 128:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    writer.write(b'\x20\x02\x00\x00')
+                elif kind == 3:  # PUBLISH
+                    size, = struct.unpack_from('!H', body)
+                    topic = body[2:2 + size].decode('utf-8')
+                    qos = (header >> 1) & 3
+                    payload = body[2 + size + (2 if qos else 0):]
+                    if qos:
+                        writer.write(b'\x40\x02' + body[2 + size:4 + size])
+                    if header & 1:
+                        if payload:
+                            self._retained[topic] = payload
+                        else:
+                            self._retained.pop(topic, None)
+                    self.published += 1
+                    self._deliver(topic, payload)
+                elif kind == 8:  # SUBSCRIBE
+                    offset, granted = 2, b''
+                    while offset < len(body):
+                        size, = struct.unpack_from('!H', body, offset)
+                        topic_filter = body[offset + 2:offset + 2 + size].decode('utf-8')
+                        offset += 3 + size
+                        self._subscriptions[writer].append(topic_filter)
+                        granted += b'\x00'
+                        for topic, payload in self._retained.items():
+                            if topic_matches(topic_filter, topic):
+                                writer.write(_publish_packet(topic, payload, True))
+                    writer.write(b'\x90' + _length(2 + len(granted)) + body[:2] + granted)
+                elif kind == 12:  # PINGREQ
+                    writer.write(b'\xd0\x00')
+                elif kind == 14:  # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscriptions.pop(writer, None)
+            writer.close()
@@ -0,0 +1,90 @@
+"""
+Rate limited publishing of state topics such as ``game/status``
+"""
+import asyncio
+import json
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class CoalescingPublisher:
+    """
+    Publishes the latest value of a topic at most once per window. Updates arriving within the
+    window replace each other and only the most recent is sent when the window closes, values
+    identical to the last one published are dropped.
+
+    Args:
+        mqtt_client: mqtt client instance
+        topic: topic to publish to
+        window: minimum seconds between publishes, 0 publishes every change immediately
+        retain: publish with the retain flag
+    """
+    def __init__(self, mqtt_client: mqtt.Client, topic: str, window: float = 0.05, retain: bool = False):
+        self.mqtt: mqtt.Client = mqtt_client
+        self.topic = topic
+        self.window = window
+        self.retain = retain
+        self.loop = None
+        self.published = 0
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._last = None
+        self._last_time = float('-inf')
+        self._scheduled = False
+
+    def update(self, value: dict, flush: bool = False, force: bool = False):
+        """
+        Queue a new value for the topic, safe to call from any thread
+
+        Args:
+            value: json serialisable value
+            flush: publish now, along with anything pending, rather than waiting for the window
+            force: publish now even if the value is the last one published, e.g. after reconnecting
+        """
+        with self._lock:
+            if self._pending is not None:
+                self.suppressed += 1
+            self._pending = value
+            if force:
+                self._last = None
+                flush = True
+            loop = self.loop if self.loop is not None and not self.loop.is_closed() else None
+            delay = self._last_time + self.window - loop.time() if loop is not None else 0
+            if flush or loop is None or (delay <= 0 and not self._scheduled):
+                self._publish_pending()
+            elif not self._scheduled:
+                self._scheduled = True
+                try:
+                    running = asyncio.get_running_loop()
+                except RuntimeError:
+                    running = None
+                if running is loop:
+                    loop.call_later(delay, self.flush)
+                else:
+                    loop.call_soon_threadsafe(loop.call_later, delay, self.flush)
+
+    def flush(self):
+        """
+        Publish any pending value
+        """
+        with self._lock:
+            self._scheduled = False
+            self._publish_pending()
+
+    def _publish_pending(self):
+        value, self._pending = self._pending, None
+        if value is None:
+            return
+        if value == self._last:
+            self.suppressed += 1
+            return
+        self._last = value
+        # windows are timed on the event loop's clock, which the simulator runs in virtual time
+        self._last_time = self.loop.time() if self.loop is not None else float('-inf')
+        self.mqtt.publish(self.topic, json.dumps(value), retain=self.retain)
+        self.published += 1
+
+    def stats(self) -> dict:
+        return {'published': self.published, 'suppressed': self.suppressed}
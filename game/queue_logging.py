@@ -0,0 +1,136 @@
+"""
+Logging set up from the ``logs`` section of config.yaml, which is a :func:`logging.config.dictConfig`
+dictionary with two optional extra keys:
+
+``queue``
+    when true, loggers hand their records to a queue and the configured handlers (files, console)
+    write them from a background thread, so a slow disk never holds up the caller
+
+``limits``
+    per logger rate limits for records below WARNING, e.g. ``root: {rate: 20, burst: 100, sample: 1}``
+    lets through at most 20 records a second, in bursts of up to 100, keeping one in every
+    ``sample`` of them. Warnings and errors are never dropped.
+
+This module is shared by the game and the detector, edit the copy in game/ and run
+``python tools/check_shared.py --sync`` to copy it to detector/, the check fails if they differ.
+"""
+import atexit
+import copy
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket limit on the records below WARNING passed by a logger
+
+    Args:
+        rate: records per second, 0 for no limit
+        burst: records that may be passed back to back
+        sample: keep one in every ``sample`` records
+    """
+    def __init__(self, rate: float = 0, burst: int = 1, sample: int = 1):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.sample = max(int(sample), 1)
+        self.dropped = 0
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            self._seen += 1
+            if self._seen % self.sample:
+                self.dropped += 1
+                return False
+            if self.rate:
+                now = time.monotonic()
+                self._tokens = min(self._tokens + (now - self._last) * self.rate, self.burst)
+                self._last = now
+                if self._tokens < 1:
+                    self.dropped += 1
+                    return False
+                self._tokens -= 1
+        return True
+
+
+class _LoggerQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records along with the handlers of the logger they were logged on, so one listener
+    thread can write the records for every logger to that logger's own handlers
+    """
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.handlers = tuple(handlers)
+
+    def prepare(self, record: logging.LogRecord):
+        # only merge the arguments into the message here, the handlers' formatters run on the
+        # listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.queue.put_nowait((self.handlers, record))
+
+
+class _LoggerQueueListener(logging.handlers.QueueListener):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+
+    def prepare(self, item):
+        return item
+
+    def stop(self):
+        # also called at exit, when it may already have been stopped
+        if self._thread is not None:
+            super().stop()
+
+    def handle(self, item):
+        handlers, record = item
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def configure(logconf: dict):
+    """
+    Configure logging from the ``logs`` section of the configuration file
+
+    :return: the queue listener writing the records when ``queue`` is set, otherwise None
+    """
+    logconf = dict(logconf)
+    use_queue = logconf.pop('queue', False)
+    limits = logconf.pop('limits', None) or {}
+    logging.config.dictConfig(logconf)
+
+    for name, settings in limits.items():
+        logger = logging.getLogger(None if name == 'root' else name)
+        logger.addFilter(RateLimitFilter(**settings))
+
+    if not use_queue:
+        return None
+    log_queue = queue.SimpleQueue()
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in logconf.get('loggers', {})
+                                       if name != 'root']
+    for logger in loggers:
+        if logger.handlers:
+            handler = _LoggerQueueHandler(log_queue, logger.handlers)
+            logger.handlers = [handler]
+    listener = _LoggerQueueListener(log_queue)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,126 @@
+"""
+Replays games from a journal written by the game service (see ``journal.py``):
+
+    python replay.py data/journal/game --list
+    python replay.py data/journal/game --game 3
+    python replay.py data/journal/game --game -1 --speed 10 --json
+
+Each event of the game is printed with its time from the start of the game, the score so far and,
+for hits, the state of the hole at the time of the hit, or when it was received if the hit has no
+time. ``--speed`` plays the game back at that many times
+real time, by default the events are printed as fast as they can be read.
+"""
+import argparse
+import bisect
+import datetime
+import json
+import math
+import sys
+import time
+
+import journal
+
+
+def games(records):
+    """
+    Split journal records into games, each a list of ``(time, kind, fields)`` from the start to
+    the end of the game
+    """
+    game = None
+    for record in records:
+        kind = record[1]
+        if kind == journal.GAME_START:
+            if game:
+                # the game never ended, e.g. the service was restarted
+                yield game
+            game = [record]
+        elif game is not None:
+            game.append(record)
+            if kind == journal.GAME_END:
+                yield game
+                game = None
+    if game:
+        yield game
+
+
+def summary(number: int, game: list) -> dict:
+    start, _, (finish_time, username) = game[0]
+    end = game[-1]
+    ended = end[1] == journal.GAME_END
+    return {'game': number,
+            'start': datetime.datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+            'user': end[2][2] if ended else username,
+            'score': end[2][0] if ended else None,
+            'seconds': round(end[0] - start, 3),
+            'hits': sum(kind == journal.SWITCH for _, kind, _ in game),
+            'events': len(game)}
+
+
+def timeline(game: list):
+    """
+    The events of a game, with the hole states and score rebuilt as it is replayed
+    """
+    start = game[0][0]
+    # the times each hole changed and its state from then on
+    holes = {}
+    score = 0
+    for when, kind, fields in game:
+        event = dict(zip(journal.KINDS[kind][1], fields))
+        event = {'t': round(when - start, 4), 'event': journal.KIND_NAMES[kind], **event}
+        if kind == journal.HOLE:
+            changes = holes.setdefault(event['hole'], ([], []))
+            changes[0].append(when)
+            changes[1].append(event['colour'] if event['status'] else 'off')
+        elif kind == journal.SWITCH:
+            hit_time = event['hit_time']
+            if math.isnan(hit_time):
+                del event['hit_time']
+                hit_time = when
+            else:
+                event['hit_time'] = round(hit_time - start, 4)
+            times, states = holes.get(event['hole'], ([], []))
+            index = bisect.bisect_right(times, hit_time)
+            event['hole_state'] = states[index - 1] if index else 'off'
+        elif kind == journal.SCORE:
+            score = event['score']
+        event['total'] = score
+        yield when, event
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay Cornhole games from a journal')
+    parser.add_argument('directory', help='journal directory, e.g. data/journal/game')
+    parser.add_argument('--list', action='store_true', help='list the games in the journal')
+    parser.add_argument('--game', type=int, default=-1, help='game to replay, from 0, negative counts from the end')
+    parser.add_argument('--speed', type=float, default=0, help='times real time, 0 for as fast as possible')
+    parser.add_argument('--json', action='store_true', help='print the events as json lines')
+    args = parser.parse_args()
+
+    played = list(games(journal.read(args.directory)))
+    if args.list:
+        for number, game in enumerate(played):
+            print(json.dumps(summary(number, game)))
+        return
+    try:
+        game = played[args.game]
+    except IndexError:
+        print(f'There are {len(played)} games in {args.directory}')
+        sys.exit(1)
+
+    print(json.dumps(summary(args.game % len(played), game)))
+    replay_start = time.perf_counter()
+    game_start = game[0][0]
+    for when, event in timeline(game):
+        if args.speed:
+            delay = (when - game_start) / args.speed - (time.perf_counter() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+        if args.json:
+            print(json.dumps(event))
+        else:
+            details = ' '.join(f'{key}={value}' for key, value in event.items() if key not in ('t', 'event', 'total'))
+            print(f'{event["t"]:>9.3f}  {event["event"]:<10} {details:<50} score={event["total"]}')
+
+
+if __name__ == '__main__':
+    main()
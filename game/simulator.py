@@ -0,0 +1,208 @@
+"""
+Headless game simulator. Plays complete games against a fake MQTT client on an event loop that runs
+in virtual time, so a 120 second game takes milliseconds and, for a given seed, always plays out
+the same way:
+
+    python simulator.py --games 100 --seed 1 --hit-rate 0.5
+
+Use ``--min-games-per-second`` to fail (exit status 1) when the game loop gets slower.
+"""
+import argparse
+import asyncio
+import json
+import random
+import selectors
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import yaml
+
+from make_game import MakeGame
+
+#: time at which the virtual clock starts, in seconds since the epoch
+VIRTUAL_EPOCH = 1_650_000_000.0
+
+
+class FakeClient:
+    """
+    Minimal stand in for :class:`paho.mqtt.client.Client` that records what is published
+    """
+    def __init__(self):
+        self.published = []
+        self.on_publish = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+        if self.on_publish is not None:
+            self.on_publish(topic, payload)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """
+    Selector that, rather than blocking until the next timer is due, moves the loop's virtual clock
+    forward to it
+    """
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            # jump exactly to the timer, adding the timeout can fall short by a rounding error
+            self.loop.virtual_time = max(self.loop.virtual_time + timeout, self.loop.next_timer())
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock only advances when there is nothing to do but wait for a timer
+    """
+    def __init__(self, start: float = VIRTUAL_EPOCH):
+        self.virtual_time = start
+        super().__init__(_VirtualSelector(self))
+        # timers due within the resolution are run, it must be above the float precision of the
+        # epoch based virtual time (~2e-7 s) or a timer the clock was moved to would never run
+        self._clock_resolution = 1e-6
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def next_timer(self) -> float:
+        return self._scheduled[0]._when if self._scheduled else self.virtual_time
+
+
+def switch_message(hole_id, colour='red', prefix='', timestamp=None):
+    payload = {'colour': colour}
+    if timestamp is not None:
+        payload['time'] = timestamp
+    return SimpleNamespace(topic=f'{prefix}switch/{hole_id}', payload=json.dumps(payload))
+
+
+class Simulation:
+    """
+    Plays games with simulated throws
+
+    Args:
+        configdata: game settings, as in the ``gamesettings`` section of config.yaml
+        seed: seed for the hole timings and the throws
+        hit_rate: probability that a throw lands in a hole
+        throw_interval: mean seconds between throws
+        switch_delay: seconds between a hit and the switch message reaching the game, switch
+            messages carry the time of the hit when set
+    """
+    def __init__(self, configdata, seed: int = 0, hit_rate: float = 0.5, throw_interval: float = 3,
+                 switch_delay: float = 0):
+        self.configdata = configdata
+        self.seed = seed
+        self.hit_rate = hit_rate
+        self.throw_interval = throw_interval
+        self.switch_delay = switch_delay
+        self.client = FakeClient()
+        self.client.on_publish = self._on_publish
+        self.throws = 0
+        self.hits = 0
+        self.latencies = []
+        self.scores = []
+        self._pending = None
+
+    def _on_publish(self, topic, payload):
+        if topic.endswith('game/leaderboard'):
+            self.scores.append(json.loads(payload)['score'])
+        elif topic.endswith('game/status') and self._pending is not None:
+            self.latencies.append(time.perf_counter() - self._pending)
+            self._pending = None
+
+    def _switch(self, game, msg):
+        self._pending = time.perf_counter()
+        game.switchevent(msg)
+
+    def play(self, game_number: int = 0) -> dict:
+        """
+        Play one game
+
+        :return: final score and message count of the game
+        """
+        loop = VirtualClockLoop()
+        throws = random.Random(f'throws-{self.seed}-{game_number}')
+        game = MakeGame(self.configdata, self.client, clock=loop.time,
+                        rng=random.Random(f'holes-{self.seed}-{game_number}'))
+        messages = len(self.client.published)
+
+        def throw():
+            if game.status != 'playing':
+                return
+            self.throws += 1
+            if throws.random() < self.hit_rate:
+                hole = throws.choice(game.holes)
+                self.hits += 1
+                colour = hole.colour if hole.status else 'off'
+                if self.switch_delay:
+                    msg = switch_message(hole.id, colour, timestamp=loop.time())
+                    loop.call_later(self.switch_delay, self._switch, game, msg)
+                else:
+                    self._switch(game, switch_message(hole.id, colour))
+            loop.call_later(throws.expovariate(1 / self.throw_interval), throw)
+
+        loop.call_later(throws.expovariate(1 / self.throw_interval), throw)
+        try:
+            loop.run_until_complete(game.startgame())
+        finally:
+            loop.close()
+        return {'score': self.scores[-1], 'messages': len(self.client.published) - messages}
+
+    def run(self, games: int) -> dict:
+        """
+        Play a series of games and report the throughput and scoring latency
+        """
+        start = time.perf_counter()
+        for game_number in range(games):
+            self.play(game_number)
+        elapsed = time.perf_counter() - start
+        latencies_ms = sorted(x * 1000 for x in self.latencies) or [0]
+        return {
+            'games': games,
+            'seconds': elapsed,
+            'games_per_second': games / elapsed,
+            'events_per_second': (self.throws + len(self.client.published)) / elapsed,
+            'throws': self.throws,
+            'hits': self.hits,
+            'messages': len(self.client.published),
+            'mean_score': statistics.mean(self.scores),
+            'scoring_latency_ms': {'median': statistics.median(latencies_ms),
+                                   'max': latencies_ms[-1]},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless Cornhole game simulator')
+    parser.add_argument('--config', default='config.yaml', help='config file for the game settings')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hit-rate', type=float, default=0.5, help='probability a throw scores')
+    parser.add_argument('--throw-interval', type=float, default=3, help='mean seconds between throws')
+    parser.add_argument('--switch-delay', type=float, default=0,
+                        help='seconds for a switch message to reach the game, sent with the hit time')
+    parser.add_argument('--schedule', action='store_true', help='precompute the hole timelines')
+    parser.add_argument('--min-games-per-second', type=float, default=None,
+                        help='exit with an error if the simulator runs slower than this')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as configfile:
+        gamesettings = yaml.safe_load(configfile)['gamesettings']
+    if args.schedule:
+        gamesettings['hole_schedule'] = True
+
+    result = Simulation(gamesettings, args.seed, args.hit_rate, args.throw_interval,
+                        args.switch_delay).run(args.games)
+    print(json.dumps(result, indent=2))
+    if args.min_games_per_second is not None and result['games_per_second'] < args.min_games_per_second:
+        print(f'Too slow: {result["games_per_second"]:.1f} games per second, '
+              f'expected at least {args.min_games_per_second}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Lightweight statistics collected by the game service, these are published on ``game/stats``
+"""
+from bisect import bisect_left
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds
+
+    Args:
+        buckets: upper bounds of the buckets, in ascending order
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        """
+        Cumulative bucket counts keyed by upper bound, with the sum and count of observations
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'sum': self.total, 'count': self.count}
+
+
+#: bucket bounds, in milliseconds, used for latency histograms
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+#: bucket bounds, in seconds, for the length of games
+DURATION_BUCKETS_S = (10, 30, 60, 90, 120, 150, 180, 300)
+
+#: bucket bounds for final scores
+SCORE_BUCKETS = (0, 50, 100, 250, 500, 750, 1000, 1500, 2000, 5000)
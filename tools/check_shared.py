@@ -0,0 +1,49 @@
+"""
+Modules shared by the game and the detector. ``game/`` and ``detector/`` are each the build
+context of their own Docker image and are run from their own directory, so a shared module is
+copied into both. This fails if the copies have drifted apart:
+
+    python tools/check_shared.py
+    python tools/check_shared.py --sync   # copy the game's version over the detector's
+"""
+import argparse
+import difflib
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: each shared module, as the copy that is edited and the copies kept in step with it
+SHARED = {
+    'game/queue_logging.py': ['detector/queue_logging.py'],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the copies of modules shared by the game and detector')
+    parser.add_argument('--sync', action='store_true', help='overwrite the copies with the edited version')
+    args = parser.parse_args()
+
+    differ = 0
+    for source, copies in SHARED.items():
+        with open(os.path.join(ROOT, source)) as original:
+            expected = original.readlines()
+        for copy in copies:
+            with open(os.path.join(ROOT, copy)) as copied:
+                found = copied.readlines()
+            if found == expected:
+                continue
+            if args.sync:
+                shutil.copyfile(os.path.join(ROOT, source), os.path.join(ROOT, copy))
+                print(f'Copied {source} to {copy}')
+                continue
+            differ += 1
+            sys.stdout.writelines(difflib.unified_diff(expected, found, source, copy))
+    if differ:
+        print(f'{differ} shared module copies differ, edit {", ".join(SHARED)} then run with --sync')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()